@@ -1,26 +1,60 @@
 import os
 import logging
 import json
+import re
+import threading
+from functools import cached_property
 from pathlib import Path
-from typing import List
+from typing import Annotated, List
 
-from dotenv import load_dotenv, dotenv_values
-from pydantic import AnyHttpUrl, Field, field_validator, model_validator
+from dotenv import dotenv_values
+from pydantic import AnyHttpUrl, BeforeValidator, Field, PrivateAttr, field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 ENV_FILE = BASE_DIR / ".env"
 
-# Принудительно перечитываем .env при каждом импорте
-if ENV_FILE.exists():
-    # Перезагружаем переменные окружения из файла
-    env_vars = dotenv_values(ENV_FILE)
-    for key, value in env_vars.items():
-        if value is not None:
-            os.environ[key] = value
-else:
-    # Если .env не существует, используем переменные окружения процесса
-    load_dotenv(ENV_FILE, override=True)
+# Целое число, занимающее весь элемент списка "id1, id2, ..."
+_ADMIN_ID_RE = re.compile(r"(?:^|,)\s*([+-]?\d+)\s*(?=,|$)")
+
+
+def _parse_admin_ids(raw: str) -> list[int]:
+    """Парсит строку вида "123, 456" в список положительных ID одним проходом regex."""
+    return [admin_id for admin_id in map(int, _ADMIN_ID_RE.findall(raw)) if admin_id > 0]
+
+
+def _coerce_optional_int(value):
+    """Приводит значение к int, нечисловые или пустые значения превращает в None."""
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return value if isinstance(value, int) else None
+
+
+# int | None, который не падает на мусоре в .env, а возвращает None
+OptionalInt = Annotated[int | None, BeforeValidator(_coerce_optional_int)]
+
+
+def _price_log_fields(kind: str) -> tuple[tuple[str, str, str], ...]:
+    """Строит таблицу полей цен одного вида (stars/rub) для логирования."""
+    return tuple(
+        (label, f"subscription_{kind}_{suffix}", f"SUBSCRIPTION_{kind.upper()}_{suffix.upper()}")
+        for label, suffix in (
+            ("1 month: ", "1month"),
+            ("3 months:", "3months"),
+            ("6 months:", "6months"),
+            ("12 months:", "12months"),
+        )
+    )
+
+
+# (заголовок, единица, [(подпись, поле Settings, переменная окружения)]) для log_config_sources
+_PRICE_LOG_FIELDS = (
+    ("Subscription prices (Stars):", "stars", _price_log_fields("stars")),
+    ("Subscription prices (RUB):", "RUB", _price_log_fields("rub")),
+)
 
 
 class Settings(BaseSettings):
@@ -30,8 +64,8 @@ class Settings(BaseSettings):
     default_locale: str = Field("ru", alias="DEFAULT_LOCALE")
     admins: List[int] = Field(default_factory=list, alias="ADMINS", json_schema_extra={"type": "string"})
     log_level: str = Field("INFO", alias="LOG_LEVEL")
-    notifications_chat_id: int | None = Field(default=None, alias="NOTIFICATIONS_CHAT_ID")
-    notifications_topic_id: int | None = Field(default=None, alias="NOTIFICATIONS_TOPIC_ID")
+    notifications_chat_id: OptionalInt = Field(default=None, alias="NOTIFICATIONS_CHAT_ID")
+    notifications_topic_id: OptionalInt = Field(default=None, alias="NOTIFICATIONS_TOPIC_ID")
     # Настройки для Telegram Stars платежей
     subscription_stars_1month: int = Field(
         default=100, 
@@ -85,36 +119,6 @@ class Settings(BaseSettings):
     # и уже потом парсим в list через property.
     default_internal_squads_raw: str | None = Field(default=None, alias="DEFAULT_INTERNAL_SQUADS")
 
-    @field_validator("notifications_chat_id", mode="before")
-    @classmethod
-    def parse_notifications_chat_id(cls, value):
-        """Парсит NOTIFICATIONS_CHAT_ID в int или возвращает None."""
-        if value is None or value == "":
-            return None
-        if isinstance(value, int):
-            return value
-        if isinstance(value, str):
-            try:
-                return int(value)
-            except ValueError:
-                return None
-        return None
-    
-    @field_validator("notifications_topic_id", mode="before")
-    @classmethod
-    def parse_notifications_topic_id(cls, value):
-        """Парсит NOTIFICATIONS_TOPIC_ID в int или возвращает None."""
-        if value is None or value == "":
-            return None
-        if isinstance(value, int):
-            return value
-        if isinstance(value, str):
-            try:
-                return int(value)
-            except ValueError:
-                return None
-        return None
-
     model_config = SettingsConfigDict(
         env_file=str(ENV_FILE),  # Явно указываем путь как строку
         env_file_encoding="utf-8",
@@ -124,9 +128,12 @@ class Settings(BaseSettings):
         case_sensitive=False,  # Не чувствительно к регистру
     )
 
+    # Заполняется в parse_admins_from_env, чтобы не строить множество на каждую проверку
+    _allowed_admins: frozenset[int] = PrivateAttr(default_factory=frozenset)
+
     @property
-    def allowed_admins(self) -> set[int]:
-        return set(self.admins)
+    def allowed_admins(self) -> frozenset[int]:
+        return self._allowed_admins
 
     @field_validator("admins", mode="before")
     @classmethod
@@ -137,17 +144,7 @@ class Settings(BaseSettings):
         if isinstance(value, int):
             return [value] if value > 0 else []
         if isinstance(value, str):
-            admins: list[int] = []
-            for part in (x.strip() for x in value.split(",")):
-                if not part:
-                    continue
-                try:
-                    admin_id = int(part)
-                    if admin_id > 0:
-                        admins.append(admin_id)
-                except ValueError:
-                    continue
-            return admins
+            return _parse_admin_ids(value)
         if isinstance(value, list):
             parsed: list[int] = []
             for x in value:
@@ -160,10 +157,37 @@ class Settings(BaseSettings):
             return parsed
         return []
     
-    @property
+    @cached_property
+    def stars_prices(self) -> dict[int, int]:
+        """Цены подписки в Stars по количеству месяцев."""
+        return {
+            1: self.subscription_stars_1month,
+            3: self.subscription_stars_3months,
+            6: self.subscription_stars_6months,
+            12: self.subscription_stars_12months,
+        }
+
+    @cached_property
+    def rub_prices(self) -> dict[int, float]:
+        """Цены подписки в рублях по количеству месяцев."""
+        return {
+            1: self.subscription_rub_1month,
+            3: self.subscription_rub_3months,
+            6: self.subscription_rub_6months,
+            12: self.subscription_rub_12months,
+        }
+
+    def prices_for(self, months: int) -> tuple[float, int]:
+        """Цена подписки (рубли, Stars) за срок; (0, 0) для неизвестного тарифа."""
+        return self.rub_prices.get(months, 0), self.stars_prices.get(months, 0)
+
+    @cached_property
     def default_internal_squads(self) -> list[str]:
         """Возвращает список внутренних squads.
 
+        Строка разбирается при первом обращении и запоминается в экземпляре;
+        после изменения .env get_settings() создаёт новый экземпляр.
+
         Поддерживает форматы:
         - "uuid1,uuid2"
         - '["uuid1","uuid2"]'
@@ -185,81 +209,103 @@ class Settings(BaseSettings):
                 pass
         return [x.strip() for x in raw.split(",") if x.strip()]
     
+    def log_config_sources(self) -> None:
+        """Логирует загруженные настройки и исходные значения из окружения.
+
+        Вызывается при старте бота и при перечитывании изменённого .env,
+        а не при каждом get_settings().
+        """
+        logger = logging.getLogger("remnabuy-config")
+        logger.info("=" * 60)
+        logger.info("SETTINGS LOADED")
+        logger.info("=" * 60)
+
+        # Логируем цены подписок
+        for title, unit, fields in _PRICE_LOG_FIELDS:
+            logger.info(title)
+            for label, attr, env_name in fields:
+                logger.info("  %s %s %s (env: %s)", label, getattr(self, attr), unit, os.getenv(env_name, "NOT SET"))
+
+        # Логируем сквады
+        logger.info("Squads configuration:")
+        logger.info("  External squad: %s (env: %s)", self.default_external_squad_uuid, os.getenv("DEFAULT_EXTERNAL_SQUAD_UUID", "NOT SET"))
+        logger.info("  Internal squads: %s (env: %s)", self.default_internal_squads, os.getenv("DEFAULT_INTERNAL_SQUADS", "NOT SET"))
+        logger.info("  Parsed internal squads count: %s", len(self.default_internal_squads) if self.default_internal_squads else 0)
+
+        # Логируем админов
+        logger.info("Admins: %s (env: %s)", self.admins, os.getenv("ADMINS", "NOT SET"))
+
+        logger.info("=" * 60)
+
     @model_validator(mode="after")
     def parse_admins_from_env(self):
         """Дополнительная проверка: если admins пустой, но ADMINS в окружении есть, парсим его."""
         if not self.admins:
             raw_env_value = os.getenv("ADMINS")
             if raw_env_value:
-                parts = [x.strip() for x in raw_env_value.split(",")]
-                admins = []
-                for part in parts:
-                    if not part:
-                        continue
-                    try:
-                        admin_id = int(part)
-                        if admin_id > 0:
-                            admins.append(admin_id)
-                    except ValueError:
-                        continue
+                admins = _parse_admin_ids(raw_env_value)
                 if admins:
                     self.admins = admins
+        self._allowed_admins = frozenset(self.admins)
         return self
 
 
 _settings_cache: Settings | None = None
+# mtime .env, с которым построен _settings_cache (None — файла нет)
+_settings_mtime: float | None = None
+_settings_lock = threading.Lock()
+
+
+def _env_file_mtime() -> float | None:
+    try:
+        return ENV_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def _load_env_file() -> None:
+    """Переносит значения из .env в os.environ за один проход.
+
+    Значения из файла имеют приоритет над окружением процесса.
+    """
+    env_vars = dotenv_values(ENV_FILE)
+    os.environ.update({key: value for key, value in env_vars.items() if value is not None})
 
 
 def get_settings(reload: bool = False) -> Settings:
     """Получить настройки приложения (с кешированием).
     
+    Настройки пересобираются только при изменении mtime файла .env,
+    в остальных случаях возвращается закешированный экземпляр.
+    
     Args:
         reload: Если True, принудительно перезагрузить настройки из .env
     """
-    global _settings_cache
+    global _settings_cache, _settings_mtime
     
-    # Если кеш есть и не требуется перезагрузка, возвращаем его
-    if _settings_cache is not None and not reload:
+    mtime = _env_file_mtime()
+    # Быстрый путь: файл не менялся с последней загрузки
+    if _settings_cache is not None and not reload and mtime == _settings_mtime:
         return _settings_cache
     
-    # Принудительно перечитываем .env файл
-    if ENV_FILE.exists():
-        env_vars = dotenv_values(ENV_FILE)
-        for key, value in env_vars.items():
-            if value is not None:
-                os.environ[key] = value
-    
-    # Создаем новый экземпляр Settings
-    settings = Settings()
-    _settings_cache = settings
-    
-    # Логируем настройки при первой загрузке или перезагрузке
-    logger = logging.getLogger("remnabuy-config")
-    logger.info("=" * 60)
-    logger.info("SETTINGS LOADED")
-    logger.info("=" * 60)
-    
-    # Логируем цены подписок
-    logger.info("Subscription prices (Stars):")
-    logger.info("  1 month:  %s stars (env: %s)", settings.subscription_stars_1month, os.getenv("SUBSCRIPTION_STARS_1MONTH", "NOT SET"))
-    logger.info("  3 months: %s stars (env: %s)", settings.subscription_stars_3months, os.getenv("SUBSCRIPTION_STARS_3MONTHS", "NOT SET"))
-    logger.info("  6 months: %s stars (env: %s)", settings.subscription_stars_6months, os.getenv("SUBSCRIPTION_STARS_6MONTHS", "NOT SET"))
-    logger.info("  12 months: %s stars (env: %s)", settings.subscription_stars_12months, os.getenv("SUBSCRIPTION_STARS_12MONTHS", "NOT SET"))
-    logger.info("Subscription prices (RUB):")
-    logger.info("  1 month:  %s RUB (env: %s)", settings.subscription_rub_1month, os.getenv("SUBSCRIPTION_RUB_1MONTH", "NOT SET"))
-    logger.info("  3 months: %s RUB (env: %s)", settings.subscription_rub_3months, os.getenv("SUBSCRIPTION_RUB_3MONTHS", "NOT SET"))
-    logger.info("  6 months: %s RUB (env: %s)", settings.subscription_rub_6months, os.getenv("SUBSCRIPTION_RUB_6MONTHS", "NOT SET"))
-    logger.info("  12 months: %s RUB (env: %s)", settings.subscription_rub_12months, os.getenv("SUBSCRIPTION_RUB_12MONTHS", "NOT SET"))
-    
-    # Логируем сквады
-    logger.info("Squads configuration:")
-    logger.info("  External squad: %s (env: %s)", settings.default_external_squad_uuid, os.getenv("DEFAULT_EXTERNAL_SQUAD_UUID", "NOT SET"))
-    logger.info("  Internal squads: %s (env: %s)", settings.default_internal_squads, os.getenv("DEFAULT_INTERNAL_SQUADS", "NOT SET"))
-    logger.info("  Parsed internal squads count: %s", len(settings.default_internal_squads) if settings.default_internal_squads else 0)
-    
-    # Логируем админов
-    logger.info("Admins: %s (env: %s)", settings.admins, os.getenv("ADMINS", "NOT SET"))
+    with _settings_lock:
+        if _settings_cache is not None and not reload and mtime == _settings_mtime:
+            return _settings_cache
+        
+        # Перечитываем .env только при изменении файла.
+        # Если .env не существует, используем переменные окружения процесса.
+        if mtime is not None:
+            _load_env_file()
+        
+        # .env уже перенесён в os.environ, поэтому pydantic-settings не должен
+        # читать и парсить тот же файл второй раз.
+        settings = Settings(_env_file=None)
+        previous = _settings_cache
+        _settings_cache = settings
+        _settings_mtime = mtime
     
-    logger.info("=" * 60)
+    # Первую загрузку логирует main.py; здесь — только перечитывание изменённого .env
+    if previous is not None:
+        settings.log_config_sources()
     
     return settings
@@ -1,10 +1,13 @@
 """База данных для пользователей бота, промокодов и рефералов."""
 import sqlite3
+import threading
 from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
+from src.utils.cache import TTLCache
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 DB_PATH = BASE_DIR / "bot_data.db"
 
@@ -41,6 +44,7 @@ def init_database():
                 remnawave_user_uuid TEXT,
                 auto_renewal BOOLEAN DEFAULT 0,
                 last_renewal_notification TIMESTAMP,
+                remnawave_short_uuid TEXT,
                 FOREIGN KEY (referrer_id) REFERENCES bot_users(telegram_id)
             )
         """)
@@ -56,6 +60,11 @@ def init_database():
         except sqlite3.OperationalError:
             pass  # Колонка уже существует
         
+        try:
+            cursor.execute("ALTER TABLE bot_users ADD COLUMN remnawave_short_uuid TEXT")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+        
         # Таблица промокодов
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS promo_codes (
@@ -133,12 +142,44 @@ def init_database():
             pass  # Колонка уже существует
 
 
+# Кэш строк bot_users: get_or_create вызывается почти на каждый апдейт.
+# Методы BotUser, меняющие пользователя, сбрасывают его запись. Доступ идет
+# и из event loop, и из потоков (asyncio.to_thread), поэтому под блокировкой.
+_bot_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_bot_user_cache_lock = threading.Lock()
+# Счетчик сбросов: строка, прочитанная до сброса, не должна попасть в кэш после него
+_bot_user_cache_generation = 0
+
+
+def _invalidate_bot_user(telegram_id: int) -> None:
+    """Удаляет пользователя из кэша после изменения его строки."""
+    global _bot_user_cache_generation
+    with _bot_user_cache_lock:
+        _bot_user_cache.pop(telegram_id, None)
+        _bot_user_cache_generation += 1
+
+
 class BotUser:
     """Модель пользователя бота."""
     
     @staticmethod
     def get_or_create(telegram_id: int, username: Optional[str] = None) -> dict:
-        """Получает или создает пользователя."""
+        """Получает или создает пользователя (с коротким кэшем)."""
+        with _bot_user_cache_lock:
+            cached = _bot_user_cache.get(telegram_id)
+            generation = _bot_user_cache_generation
+        if cached is not None:
+            return dict(cached)
+        
+        user = BotUser._get_or_create_uncached(telegram_id, username)
+        with _bot_user_cache_lock:
+            if generation == _bot_user_cache_generation:
+                _bot_user_cache[telegram_id] = user
+        return dict(user)
+    
+    @staticmethod
+    def _get_or_create_uncached(telegram_id: int, username: Optional[str] = None) -> dict:
+        """Получает или создает пользователя напрямую из БД."""
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
@@ -170,6 +211,7 @@ class BotUser:
                 "UPDATE bot_users SET language = ? WHERE telegram_id = ?",
                 (language, telegram_id)
             )
+        _invalidate_bot_user(telegram_id)
     
     @staticmethod
     def set_trial_used(telegram_id: int):
@@ -179,6 +221,7 @@ class BotUser:
                 "UPDATE bot_users SET trial_used = 1 WHERE telegram_id = ?",
                 (telegram_id,)
             )
+        _invalidate_bot_user(telegram_id)
     
     @staticmethod
     def set_referrer(telegram_id: int, referrer_id: int):
@@ -188,15 +231,27 @@ class BotUser:
                 "UPDATE bot_users SET referrer_id = ? WHERE telegram_id = ?",
                 (referrer_id, telegram_id)
             )
+        _invalidate_bot_user(telegram_id)
     
     @staticmethod
-    def set_remnawave_uuid(telegram_id: int, uuid: str):
-        """Сохраняет UUID пользователя в Remnawave."""
+    def set_remnawave_uuid(telegram_id: int, uuid: str, short_uuid: Optional[str] = None):
+        """Сохраняет UUID (и shortUuid, если известен) пользователя в Remnawave."""
         with get_db_connection() as conn:
             conn.execute(
-                "UPDATE bot_users SET remnawave_user_uuid = ? WHERE telegram_id = ?",
-                (uuid, telegram_id)
+                "UPDATE bot_users SET remnawave_user_uuid = ?, remnawave_short_uuid = ? WHERE telegram_id = ?",
+                (uuid, short_uuid, telegram_id)
             )
+        _invalidate_bot_user(telegram_id)
+    
+    @staticmethod
+    def set_remnawave_short_uuid(telegram_id: int, short_uuid: Optional[str]):
+        """Сохраняет shortUuid пользователя в Remnawave."""
+        with get_db_connection() as conn:
+            conn.execute(
+                "UPDATE bot_users SET remnawave_short_uuid = ? WHERE telegram_id = ?",
+                (short_uuid, telegram_id)
+            )
+        _invalidate_bot_user(telegram_id)
     
     @staticmethod
     def set_auto_renewal(telegram_id: int, enabled: bool):
@@ -206,6 +261,7 @@ class BotUser:
                 "UPDATE bot_users SET auto_renewal = ? WHERE telegram_id = ?",
                 (1 if enabled else 0, telegram_id)
             )
+        _invalidate_bot_user(telegram_id)
     
     @staticmethod
     def get_auto_renewal(telegram_id: int) -> bool:
@@ -227,6 +283,7 @@ class BotUser:
                 "UPDATE bot_users SET last_renewal_notification = ? WHERE telegram_id = ?",
                 (datetime.now().isoformat(), telegram_id)
             )
+        _invalidate_bot_user(telegram_id)
     
     @staticmethod
     def get_users_with_auto_renewal():
@@ -242,6 +299,22 @@ class BotUser:
             return [dict(row) for row in rows]
 
 
+# Кэш промокодов: на кнопках оплаты один и тот же код читается на каждое нажатие.
+# Сбрасывается при создании и использовании кода.
+_promo_cache: TTLCache = TTLCache(maxsize=1024, ttl=30)
+# Недавно введенные несуществующие коды (опечатки), чтобы не искать их в БД повторно
+_missing_promo_codes: TTLCache = TTLCache(maxsize=512, ttl=30)
+_promo_cache_lock = threading.Lock()
+
+
+def _invalidate_promo(code: str) -> None:
+    """Удаляет промокод из кэша после изменения его строки."""
+    code = code.upper()
+    with _promo_cache_lock:
+        _promo_cache.pop(code, None)
+        _missing_promo_codes.pop(code, None)
+
+
 class PromoCode:
     """Модель промокода."""
     
@@ -259,6 +332,7 @@ class PromoCode:
                 INSERT INTO promo_codes (code, discount_percent, bonus_days, max_uses, expires_at)
                 VALUES (?, ?, ?, ?, ?)
             """, (code.upper(), discount_percent, bonus_days, max_uses, expires_at))
+        _invalidate_promo(code)
     
     @staticmethod
     def get(code: str) -> Optional[dict]:
@@ -273,44 +347,90 @@ class PromoCode:
             return dict(row) if row else None
     
     @staticmethod
-    def can_use(code: str) -> tuple[bool, Optional[str]]:
-        """Проверяет, можно ли использовать промокод."""
-        promo = PromoCode.get(code)
+    def get_cached(code: str) -> Optional[dict]:
+        """PromoCode.get с коротким кэшем — для проверки и расчета цены.
+        
+        Списание (PromoCode.use) всегда перепроверяет код по БД.
+        """
+        code = code.upper()
+        with _promo_cache_lock:
+            if code in _missing_promo_codes:
+                return None
+            promo = _promo_cache.get(code)
+        if promo is None:
+            promo = PromoCode.get(code)
+            with _promo_cache_lock:
+                if promo:
+                    _promo_cache[code] = promo
+                else:
+                    _missing_promo_codes[code] = True
+        return dict(promo) if promo else None
+    
+    @staticmethod
+    def _validation_error(promo: Optional[dict]) -> Optional[str]:
+        """Возвращает текст ошибки, если промокод нельзя использовать."""
         if not promo:
-            return False, "Промокод не найден"
+            return "Промокод не найден"
         
         if promo.get("expires_at"):
             expires = datetime.fromisoformat(promo["expires_at"])
             if datetime.now() > expires:
-                return False, "Промокод истек"
+                return "Промокод истек"
         
         if promo.get("max_uses"):
             if promo["current_uses"] >= promo["max_uses"]:
-                return False, "Промокод больше недействителен"
+                return "Промокод больше недействителен"
+        
+        return None
+    
+    @staticmethod
+    def validate(code: str) -> tuple[Optional[dict], Optional[str]]:
+        """Проверяет промокод и возвращает его вместе с ошибкой.
         
-        return True, None
+        Returns:
+            (promo, None), если промокод можно использовать, иначе (None, текст ошибки)
+        """
+        promo = PromoCode.get_cached(code)
+        error = PromoCode._validation_error(promo)
+        if error:
+            return None, error
+        return promo, None
+    
+    @staticmethod
+    def can_use(code: str) -> tuple[bool, Optional[str]]:
+        """Проверяет, можно ли использовать промокод."""
+        promo, error = PromoCode.validate(code)
+        return promo is not None, error
     
     @staticmethod
     def use(code: str, user_id: int) -> bool:
         """Использует промокод."""
-        can_use, error = PromoCode.can_use(code)
-        if not can_use:
-            return False
-        
+        code = code.upper()
         with get_db_connection() as conn:
-            # Увеличиваем счетчик использования
-            conn.execute("""
+            # Проверка и списание выполняются в одном соединении
+            row = conn.execute(
+                "SELECT * FROM promo_codes WHERE code = ? AND is_active = 1",
+                (code,)
+            ).fetchone()
+            if PromoCode._validation_error(dict(row) if row else None):
+                return False
+            
+            # Увеличиваем счетчик использования (повторно проверяя лимит на случай гонки)
+            cursor = conn.execute("""
                 UPDATE promo_codes 
                 SET current_uses = current_uses + 1 
-                WHERE code = ?
-            """, (code.upper(),))
+                WHERE code = ? AND (max_uses IS NULL OR max_uses = 0 OR current_uses < max_uses)
+            """, (code,))
+            if cursor.rowcount == 0:
+                return False
             
             # Записываем использование
             conn.execute("""
                 INSERT INTO promo_code_usage (code, user_id)
                 VALUES (?, ?)
-            """, (code.upper(), user_id))
-            
+            """, (code, user_id))
+        
+        _invalidate_promo(code)
         return True
 
 
@@ -354,6 +474,18 @@ class Referral:
             result = cursor.fetchone()[0]
             return result if result else 0
     
+    @staticmethod
+    def get_stats(referrer_id: int) -> tuple[int, int]:
+        """Получает количество рефералов и сумму бонусных дней одним запросом."""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bonus_days), 0) FROM referrals WHERE referrer_id = ?",
+                (referrer_id,)
+            )
+            count, bonus_days = cursor.fetchone()
+            return count, bonus_days
+    
     @staticmethod
     def grant_bonus(referrer_id: int, referred_id: int, bonus_days: int) -> bool:
         """Начисляет бонусные дни за реферала (обновляет запись)."""
@@ -1,10 +1,20 @@
 """Общие утилиты для всех обработчиков."""
 import asyncio
 
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 from aiogram.utils.i18n import gettext as _
 
-from src.handlers.state import ADMIN_COMMAND_DELETE_DELAY, LAST_BOT_MESSAGES
+from src.database import BotUser
+from src.handlers.state import (
+    ADMIN_COMMAND_DELETE_DELAY,
+    LAST_BOT_MESSAGES,
+    PENDING_INPUT,
+    SUBS_PAGE_BY_USER,
+    USER_DETAIL_BACK_TARGET,
+    USER_LOCALES,
+    USER_SEARCH_CONTEXT,
+)
 from src.utils.auth import is_admin
 from src.utils.logger import logger
 
@@ -26,6 +36,16 @@ async def _cleanup_message(message: Message, delay: float = 0.0) -> None:
         )
 
 
+async def _get_user_locale(user_id: int, username: str | None) -> str:
+    """Возвращает язык пользователя, читая БД только при промахе кэша."""
+    locale = USER_LOCALES.get(user_id)
+    if locale is None:
+        user = await asyncio.to_thread(BotUser.get_or_create, user_id, username)
+        locale = user.get("language", "ru")
+        USER_LOCALES[user_id] = locale
+    return locale
+
+
 async def _send_clean_message(
     target: Message | CallbackQuery,
     text: str,
@@ -81,13 +101,6 @@ def _get_target_user_id(target: Message | CallbackQuery) -> int | None:
 
 def _clear_user_state(user_id: int | None, keep_search: bool = False, keep_subs: bool = False) -> None:
     """Очищает состояние пользователя."""
-    from src.handlers.state import (
-        PENDING_INPUT,
-        SUBS_PAGE_BY_USER,
-        USER_DETAIL_BACK_TARGET,
-        USER_SEARCH_CONTEXT,
-    )
-
     if user_id is None:
         return
     PENDING_INPUT.pop(user_id, None)
@@ -101,9 +114,13 @@ def _clear_user_state(user_id: int | None, keep_search: bool = False, keep_subs:
 async def _edit_text_safe(
     message: Message, text: str, reply_markup: InlineKeyboardMarkup | None = None, parse_mode: str | None = None
 ) -> None:
-    """Безопасно редактирует текст сообщения, обрабатывая ошибки."""
-    from aiogram.exceptions import TelegramBadRequest
-
+    """Безопасно редактирует текст сообщения, обрабатывая ошибки.
+    
+    Если сообщение уже содержит тот же текст и клавиатуру, запрос к Telegram
+    не отправляется (он всё равно вернул бы "message is not modified").
+    """
+    if parse_mode is None and message.text == text and message.reply_markup == reply_markup:
+        return
     try:
         await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
     except TelegramBadRequest as exc:
@@ -1,16 +1,76 @@
 """Обработчики платежей через Telegram Stars и YooKassa."""
+import asyncio
+from functools import lru_cache
+
 from aiogram import F, Router
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message, PreCheckoutQuery
 from aiogram.utils.i18n import gettext as _
 
-from src.database import BotUser, Payment
+from src.database import Payment
+from src.handlers.common import _get_user_locale
 from src.services.payment_service import process_successful_payment, process_yookassa_payment
 from src.services.yookassa_service import get_payment_status
+from src.utils.cache import TTLCache
 from src.utils.i18n import get_i18n
 from src.utils.logger import logger
 
 router = Router(name="payments")
 
+_YOOKASSA_CHECK_PREFIX = "yookassa:check_status:"
+
+# Telegram может прислать несколько pre_checkout_query подряд для одного счёта,
+# поэтому платеж по payload кэшируется на короткое время.
+_pre_checkout_payments: TTLCache = TTLCache(maxsize=1024, ttl=30)
+
+
+async def _cached_payment(invoice_payload: str) -> dict | None:
+    """Возвращает платеж по payload, используя короткоживущий кэш."""
+    payment = _pre_checkout_payments.get(invoice_payload)
+    if payment is None:
+        payment = await asyncio.to_thread(Payment.get_by_payload, invoice_payload)
+        if payment:
+            _pre_checkout_payments[invoice_payload] = payment
+    return payment
+
+
+@lru_cache(maxsize=16)
+def _my_access_button(locale: str) -> InlineKeyboardButton:
+    """Кнопка "Мой доступ" для указанной локали (текст не зависит от платежа)."""
+    return InlineKeyboardButton(
+        text=get_i18n().gettext("user_menu.my_access", locale=locale),
+        callback_data="user:my_access"
+    )
+
+
+@lru_cache(maxsize=16)
+def _my_access_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура из одной кнопки "Мой доступ"."""
+    return InlineKeyboardMarkup(inline_keyboard=[[_my_access_button(locale)]])
+
+
+def _payment_success_keyboard(locale: str, subscription_url: str) -> InlineKeyboardMarkup:
+    """Клавиатура после оплаты: ссылка на подписку (если есть) и "Мой доступ"."""
+    if not subscription_url:
+        return _my_access_keyboard(locale)
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=get_i18n().gettext("user.get_config", locale=locale),
+            url=subscription_url
+        )],
+        [_my_access_button(locale)],
+    ])
+
+
+@lru_cache(maxsize=16)
+def _back_to_menu_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой возврата в меню пользователя."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text=get_i18n().gettext("user_menu.back", locale=locale),
+            callback_data="user:menu"
+        )
+    ]])
+
 
 @router.pre_checkout_query()
 async def process_pre_checkout(pre_checkout_query: PreCheckoutQuery) -> None:
@@ -19,19 +79,17 @@ async def process_pre_checkout(pre_checkout_query: PreCheckoutQuery) -> None:
     
     try:
         # Проверяем платеж в БД
-        payment = Payment.get_by_payload(invoice_payload)
+        payment = await _cached_payment(invoice_payload)
         
         if not payment:
-            await pre_checkout_query.bot.answer_pre_checkout_query(
-                pre_checkout_query.id,
+            await pre_checkout_query.answer(
                 ok=False,
                 error_message="Платеж не найден. Пожалуйста, создайте новый заказ."
             )
             return
         
         if payment["status"] == "completed":
-            await pre_checkout_query.bot.answer_pre_checkout_query(
-                pre_checkout_query.id,
+            await pre_checkout_query.answer(
                 ok=False,
                 error_message="Этот платеж уже был обработан."
             )
@@ -39,22 +97,17 @@ async def process_pre_checkout(pre_checkout_query: PreCheckoutQuery) -> None:
         
         # Проверяем сумму
         if payment["stars"] != pre_checkout_query.total_amount:
-            await pre_checkout_query.bot.answer_pre_checkout_query(
-                pre_checkout_query.id,
+            await pre_checkout_query.answer(
                 ok=False,
                 error_message="Сумма платежа не совпадает. Пожалуйста, создайте новый заказ."
             )
             return
         
         # Все проверки пройдены
-        await pre_checkout_query.bot.answer_pre_checkout_query(
-            pre_checkout_query.id,
-            ok=True
-        )
+        await pre_checkout_query.answer(ok=True)
     except Exception as e:
         logger.exception("Error in pre_checkout_query")
-        await pre_checkout_query.bot.answer_pre_checkout_query(
-            pre_checkout_query.id,
+        await pre_checkout_query.answer(
             ok=False,
             error_message="Произошла ошибка при обработке платежа. Попробуйте позже."
         )
@@ -69,8 +122,7 @@ async def process_successful_payment_message(message: Message) -> None:
     invoice_payload = payment_info.invoice_payload
     total_amount = payment_info.total_amount
     
-    user = BotUser.get_or_create(user_id, message.from_user.username)
-    locale = user.get("language", "ru")
+    locale = await _get_user_locale(user_id, message.from_user.username)
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
@@ -82,147 +134,99 @@ async def process_successful_payment_message(message: Message) -> None:
                 total_amount=total_amount,
                 bot=message.bot
             )
+            # Статус платежа изменился — запись в кэше pre-checkout больше не актуальна
+            _pre_checkout_payments.pop(invoice_payload, None)
             
             if result.get("success"):
                 if result.get("already_completed"):
                     # Если уже обработан, просто показываем "Мой доступ"
-                    buttons = [[
-                        InlineKeyboardButton(
-                            text=_("user_menu.my_access"),
-                            callback_data="user:my_access"
-                        )
-                    ]]
                     await message.answer(
                         _("payment.already_processed"),
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-                        parse_mode="HTML"
+                        reply_markup=_my_access_keyboard(locale)
                     )
                     return
                 else:
                     subscription_url = result.get("subscription_url", "")
                     expire_date = result.get("expire_date", "")
+                    expire_day = expire_date[:10] if expire_date else _("payment.unknown")
                     
-                    text = _("payment.success").format(
-                        expire_date=expire_date[:10] if expire_date else _("payment.unknown")
-                    )
-                    
-                    buttons = []
-                    if subscription_url:
-                        buttons.append([InlineKeyboardButton(
-                            text=_("user.get_config"),
-                            url=subscription_url
-                        )])
-                    buttons.append([InlineKeyboardButton(
-                        text=_("user_menu.my_access"),
-                        callback_data="user:my_access"
-                    )])
+                    text = _("payment.success").format(expire_date=expire_day)
                     
                     await message.answer(
                         text,
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-                        parse_mode="HTML"
+                        reply_markup=_payment_success_keyboard(locale, subscription_url)
                     )
                     return
             else:
-                error = result.get("error", _("payment.error_processing"))
-                text = _("payment.error").format(error=error)
-                text += f"\n\n{_('payment.contact_support')}"
-                
-                buttons = [[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back"),
-                        callback_data="user:menu"
-                    )
-                ]]
+                error = result.get("error") or _("payment.error_processing")
+                text = f"{_('payment.error').format(error=error)}\n\n{_('payment.contact_support')}"
                 
                 await message.answer(
                     text,
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-                    parse_mode="HTML"
+                    reply_markup=_back_to_menu_keyboard(locale)
                 )
                 return
         except Exception as e:
             logger.exception("Error processing successful payment")
-            await message.answer(
-                _("payment.error_processing"),
-                parse_mode="HTML"
-            )
+            await message.answer(_("payment.error_processing"))
 
 
-@router.callback_query(F.data.startswith("yookassa:check_status:"))
+@router.callback_query(F.data.startswith(_YOOKASSA_CHECK_PREFIX))
 async def check_yookassa_payment_status(callback: CallbackQuery) -> None:
     """Проверяет статус платежа YooKassa."""
+    payment_id = callback.data[len(_YOOKASSA_CHECK_PREFIX):]
+    locale = await _get_user_locale(callback.from_user.id, callback.from_user.username)
     try:
-        payment_id = callback.data.split(":")[-1]
-        
-        user = BotUser.get_or_create(callback.from_user.id, callback.from_user.username)
-        locale = user.get("language", "ru")
-        
         i18n = get_i18n()
         with i18n.use_locale(locale):
             # Получаем статус платежа из YooKassa
-            try:
-                status_data = await get_payment_status(payment_id)
-                payment_status = status_data.get("status")
-                paid = status_data.get("paid", False)
-                
-                # Находим платеж в БД
-                payment = Payment.get_by_yookassa_payment_id(payment_id)
-                
-                if not payment:
-                    await callback.answer(_("payment.error_processing"), show_alert=True)
-                    return
-                
-                if paid and payment_status == "succeeded":
-                    # Платеж успешен, обрабатываем его
-                    if payment["status"] != "completed":
-                        result = await process_yookassa_payment(payment_id, bot=callback.bot)
-                        
-                        if result.get("success"):
-                            if result.get("already_completed"):
-                                await callback.answer(_("payment.already_processed"), show_alert=True)
-                            else:
-                                subscription_url = result.get("subscription_url", "")
-                                expire_date = result.get("expire_date", "")
-                                
-                                text = _("payment.success").format(
-                                    expire_date=expire_date[:10] if expire_date else _("payment.unknown")
-                                )
-                                
-                                buttons = []
-                                if subscription_url:
-                                    buttons.append([InlineKeyboardButton(
-                                        text=_("user.get_config"),
-                                        url=subscription_url
-                                    )])
-                                buttons.append([InlineKeyboardButton(
-                                    text=_("user_menu.my_access"),
-                                    callback_data="user:my_access"
-                                )])
-                                
-                                await callback.message.edit_text(
-                                    text,
-                                    reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-                                    parse_mode="HTML"
-                                )
-                                await callback.answer()
-                                return
-                    else:
-                        await callback.answer(_("payment.already_processed"), show_alert=True)
-                        return
-                elif payment_status == "pending":
-                    await callback.answer(_("payment.yookassa.pending"), show_alert=True)
-                    return
-                elif payment_status == "canceled":
-                    await callback.answer(_("payment.yookassa.canceled"), show_alert=True)
-                    return
+            status_data = await get_payment_status(payment_id)
+            payment_status = status_data.get("status")
+            paid = status_data.get("paid", False)
+            
+            # Находим платеж в БД
+            payment = await asyncio.to_thread(Payment.get_by_yookassa_payment_id, payment_id)
+            
+            if not payment:
+                await callback.answer(_("payment.error_processing"), show_alert=True)
+                return
+            
+            if paid and payment_status == "succeeded":
+                # Платеж успешен, обрабатываем его
+                if payment["status"] != "completed":
+                    result = await process_yookassa_payment(payment_id, bot=callback.bot)
+                    
+                    if result.get("success"):
+                        if result.get("already_completed"):
+                            await callback.answer(_("payment.already_processed"), show_alert=True)
+                        else:
+                            subscription_url = result.get("subscription_url", "")
+                            expire_date = result.get("expire_date", "")
+                            expire_day = expire_date[:10] if expire_date else _("payment.unknown")
+                            
+                            text = _("payment.success").format(expire_date=expire_day)
+                            
+                            await callback.message.edit_text(
+                                text,
+                                reply_markup=_payment_success_keyboard(locale, subscription_url)
+                            )
+                            await callback.answer()
+                            return
                 else:
-                    await callback.answer(_("payment.yookassa.waiting"), show_alert=True)
+                    await callback.answer(_("payment.already_processed"), show_alert=True)
                     return
-            except Exception as e:
-                logger.exception(f"Error checking YooKassa payment status: {e}")
-                await callback.answer(_("payment.error_processing"), show_alert=True)
+            elif payment_status == "pending":
+                await callback.answer(_("payment.yookassa.pending"), show_alert=True)
+                return
+            elif payment_status == "canceled":
+                await callback.answer(_("payment.yookassa.canceled"), show_alert=True)
+                return
+            else:
+                await callback.answer(_("payment.yookassa.waiting"), show_alert=True)
+                return
     except Exception as e:
-        logger.exception("Error in check_yookassa_payment_status")
-        await callback.answer(_("payment.error_processing"), show_alert=True)
-
+        logger.exception("Error checking YooKassa payment status: %s", e)
+        await callback.answer(
+            get_i18n().gettext("payment.error_processing", locale=locale),
+            show_alert=True
+        )
@@ -1,448 +1,478 @@
 """Простой процесс покупки подписки через YooKassa."""
+import asyncio
+import logging
+import re
+from functools import lru_cache
+
 from aiogram import F, Router
+from aiogram.filters import BaseFilter
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.utils.i18n import gettext as _
 from aiogram.types import BufferedInputFile
 
-from src.database import BotUser, PromoCode
-from src.handlers.common import _edit_text_safe
-from src.services.payment_service import create_yookassa_payment
+from src.config import get_settings
+from src.database import PromoCode
+from src.handlers.common import _edit_text_safe, _get_user_locale
+from src.services.payment_service import create_subscription_invoice, create_yookassa_payment
 from src.keyboards.yookassa_payment import get_yookassa_payment_keyboard
+from src.utils.auth import is_admin
 from src.utils.i18n import get_i18n
 from src.utils.logger import logger
 from src.handlers.state import PENDING_INPUT
+from src.utils.cache import TTLCache
 
 router = Router(name="purchase")
 
+_MONTH_LABEL_KEYS = {
+    1: "payment.subscription_1month",
+    3: "payment.subscription_3months",
+    6: "payment.subscription_6months",
+    12: "payment.subscription_12months",
+}
+
+
+# Префикс записи PENDING_INPUT, означающей "ждем промокод для тарифа"
+_PROMO_PENDING_PREFIX = "promo_for_purchase:"
+# \Z вместо $: "$" допускает завершающий перевод строки ("CODE\n")
+_PROMO_RE = re.compile(r"^[A-Za-z0-9]{3,20}\Z")
+# purchase:<месяцы>[:<действие>[:<промокод>]]
+_CB_RE = re.compile(r"^purchase:(\d+)(?::([a-z]+))?(?::([A-Za-z0-9]*))?$")
+
+
+class PromoPendingFilter(BaseFilter):
+    """Пропускает сообщение, только если от пользователя ждут промокод.
+
+    Дешёвая проверка PENDING_INPUT выполняется до regex, поэтому обычные
+    сообщения отсекаются сразу и остаются доступны другим обработчикам.
+    """
+
+    async def __call__(self, message: Message) -> bool:
+        if message.from_user is None:
+            return False
+        # В PENDING_INPUT лежат и состояния админских диалогов (dict) — их сообщения
+        # не должны перехватываться здесь, иначе они не дойдут до своих обработчиков.
+        pending = PENDING_INPUT.get(message.from_user.id)
+        if not isinstance(pending, str) or not pending.startswith(_PROMO_PENDING_PREFIX):
+            return False
+        return bool(_PROMO_RE.match(message.text or ""))
+
+
+@lru_cache(maxsize=64)
+def _month_label(locale: str, months: int) -> str:
+    """Название тарифа без цены (например, "1 месяц") для указанной локали."""
+    key = _MONTH_LABEL_KEYS.get(months)
+    if key is None:
+        return f"{months} месяцев"
+    return get_i18n().gettext(key, locale=locale).split(" (")[0]
+
+
+@lru_cache(maxsize=8)
+def _buy_menu_markup(locale: str) -> InlineKeyboardMarkup:
+    """Меню выбора тарифа: только названия тарифов, без цен."""
+    buttons = [
+        [InlineKeyboardButton(text=_month_label(locale, months), callback_data=f"purchase:{months}")]
+        for months in _MONTH_LABEL_KEYS
+    ]
+    buttons.append([
+        InlineKeyboardButton(
+            text=get_i18n().gettext("user_menu.back", locale=locale),
+            callback_data="user:connect"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@lru_cache(maxsize=16)
+def _back_to_buy_kb(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура с единственной кнопкой возврата к выбору тарифа."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text=get_i18n().gettext("user_menu.back", locale=locale),
+            callback_data="user:buy"
+        )
+    ]])
+
+
+@lru_cache(maxsize=64)
+def _back_to_tariff_kb(locale: str, months: int) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой возврата к выбору способа оплаты тарифа."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text=get_i18n().gettext("user_menu.back", locale=locale),
+            callback_data=f"purchase:{months}"
+        )
+    ]])
+
+
+@lru_cache(maxsize=256)
+def _promo_methods_kb(locale: str, months: int, promo_code: str, stars: int, rub: str) -> InlineKeyboardMarkup:
+    """Способы оплаты тарифа с применённым промокодом (цены уже со скидкой)."""
+    gettext = get_i18n().gettext
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=gettext("payment.payment_method_stars", locale=locale) + f" ({stars} ⭐)",
+                callback_data=f"purchase:{months}:stars:{promo_code}"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=gettext("payment.payment_method_sbp", locale=locale) + f" ({rub} ₽)",
+                callback_data=f"purchase:{months}:sbp:{promo_code}"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=gettext("payment.payment_method_card", locale=locale) + f" ({rub} ₽)",
+                callback_data=f"purchase:{months}:card:{promo_code}"
+            )
+        ],
+        *_back_to_tariff_kb(locale, months).inline_keyboard,
+    ])
+
+
+@lru_cache(maxsize=256)
+def _promo_line(locale: str, kind: str, value: int) -> str:
+    """Строка о применённом промокоде: kind — "discount" или "bonus"."""
+    gettext = get_i18n().gettext
+    applied = gettext("user.promo_applied", locale=locale)
+    if kind == "discount":
+        return f"\n\n🎫 {applied}: {value}% {gettext('user.promo_discount', locale=locale)}"
+    return f"\n\n🎫 {applied}: +{value} {gettext('user.promo_bonus_days', locale=locale)}"
+
+
+def _format_promo_text(locale: str, promo: dict | None) -> str:
+    """Строка о применённом промокоде для текста сообщения."""
+    if not promo:
+        return ""
+    if promo.get("discount_percent"):
+        return _promo_line(locale, "discount", promo["discount_percent"])
+    if promo.get("bonus_days"):
+        return _promo_line(locale, "bonus", promo["bonus_days"])
+    return ""
+
 
 @router.callback_query(F.data == "user:buy")
 async def cb_buy(callback: CallbackQuery) -> None:
     """Показывает выбор тарифа подписки."""
-    await callback.answer()
+    # Подтверждаем нажатие параллельно с получением локали
+    ack = asyncio.create_task(callback.answer())
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
+    locale = await _get_user_locale(user_id, callback.from_user.username)
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        from src.config import get_settings
-        settings = get_settings()
+        await _edit_text_safe(
+            callback.message,
+            _("payment.choose_subscription"),
+            reply_markup=_buy_menu_markup(locale)
+        )
+    await ack
+
+
+def _log_payment_failure(kind: str, user_id: int, subscription_months: int, error: Exception) -> None:
+    """Логирует ошибку создания платежа одной строкой.
+
+    Полный traceback уже пишет сервис платежей; здесь он добавляется только
+    на уровне DEBUG, чтобы при массовых сбоях не сериализовать его повторно.
+    """
+    logger.error(
+        "Error creating %s: user_id=%s months=%s err=%s: %.200s",
+        kind,
+        user_id,
+        subscription_months,
+        type(error).__name__,
+        error,
+        exc_info=logger.isEnabledFor(logging.DEBUG),
+    )
+
+
+# Пользователи, которым недавно показали ошибку оплаты: повторные ошибки
+# в течение ttl не отправляются, чтобы не забивать лимиты Telegram при сбоях
+_recent_errors: TTLCache = TTLCache(maxsize=10_000, ttl=2.0)
+
+
+async def _send_error(message: Message, user_id: int, locale: str, text: str | None = None) -> None:
+    """Показывает ошибку создания платежа с кнопкой возврата к тарифам."""
+    if user_id in _recent_errors:
+        return
+    _recent_errors[user_id] = True
+    await _edit_text_safe(
+        message,
+        text or _("payment.error_creating_invoice"),
+        reply_markup=_back_to_buy_kb(locale)
+    )
+
+
+async def _handle_stars(
+    callback: CallbackQuery, user_id: int, locale: str, subscription_months: int, promo_code: str | None
+) -> None:
+    """Создает счет Telegram Stars и показывает кнопку оплаты."""
+    try:
+        invoice_link = await create_subscription_invoice(
+            bot=callback.message.bot,
+            user_id=user_id,
+            subscription_months=subscription_months,
+            promo_code=promo_code
+        )
         
-        # Получаем цены в рублях
-        rub_prices = {
-            1: settings.subscription_rub_1month,
-            3: settings.subscription_rub_3months,
-            6: settings.subscription_rub_6months,
-            12: settings.subscription_rub_12months,
-        }
+        # Формируем текст с промокодом
+        promo = PromoCode.get_cached(promo_code) if promo_code else None
+        promo_text = _format_promo_text(locale, promo)
         
-        # Убираем цены из кнопок - только название тарифа
         buttons = [
             [
                 InlineKeyboardButton(
-                    text=_("payment.subscription_1month").split(" (")[0],
-                    callback_data="purchase:1"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("payment.subscription_3months").split(" (")[0],
-                    callback_data="purchase:3"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("payment.subscription_6months").split(" (")[0],
-                    callback_data="purchase:6"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("payment.subscription_12months").split(" (")[0],
-                    callback_data="purchase:12"
+                    text=_("payment.pay_button"),
+                    url=invoice_link
                 )
             ],
             [
                 InlineKeyboardButton(
                     text=_("user_menu.back"),
-                    callback_data="user:connect"
+                    callback_data="user:buy"
                 )
             ]
         ]
         
         await _edit_text_safe(
             callback.message,
-            _("payment.choose_subscription"),
+            _("payment.invoice_created") + promo_text,
             reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
         )
+    except Exception as e:
+        _log_payment_failure("Stars invoice", user_id, subscription_months, e)
+        await _send_error(callback.message, user_id, locale)
+
+
+async def _handle_yookassa(
+    callback: CallbackQuery,
+    user_id: int,
+    locale: str,
+    subscription_months: int,
+    promo_code: str | None,
+    payment_method: str,
+) -> None:
+    """Создает платеж YooKassa (СБП или карта) и показывает ссылку на оплату."""
+    try:
+        payment_data = await create_yookassa_payment(
+            bot=callback.message.bot,
+            user_id=user_id,
+            subscription_months=subscription_months,
+            promo_code=promo_code,
+            payment_method=payment_method
+        )
+        
+        payment_id = payment_data["payment_id"]
+        confirmation_url = payment_data.get("confirmation_url")
+        amount = payment_data.get("amount", 0)
+        qr_code = payment_data.get("qr_code")
+        
+        # Формируем текст с промокодом
+        promo = PromoCode.get_cached(promo_code) if promo_code else None
+        promo_text = _format_promo_text(locale, promo)
+        
+        text = _("payment.yookassa.payment_created").format(
+            amount=f"{amount:.0f}",
+            payment_id=payment_id[:16] + "..."
+        ) + promo_text
+        
+        keyboard = get_yookassa_payment_keyboard(
+            payment_id=payment_id,
+            confirmation_url=confirmation_url
+        )
+        
+        sends = [
+            _edit_text_safe(
+                callback.message,
+                text,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+        ]
+        # QR-код для СБП отправляем параллельно с обновлением сообщения
+        if qr_code and payment_method == "sbp":
+            sends.append(callback.message.answer_photo(
+                BufferedInputFile(qr_code, filename="qr_code.png"),
+                caption=_("payment.yookassa.qr_code_sent")
+            ))
+        await asyncio.gather(*sends)
+    except ValueError as e:
+        error_text = _("payment.error_creating_invoice")
+        if "not configured" in str(e).lower():
+            error_text += "\n\n⚠️ YooKassa не настроен. Проверьте YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY в .env"
+        await _send_error(callback.message, user_id, locale, error_text)
+    except Exception as e:
+        _log_payment_failure("YooKassa payment", user_id, subscription_months, e)
+        await _send_error(callback.message, user_id, locale)
+
+
+async def _handle_sbp(
+    callback: CallbackQuery, user_id: int, locale: str, subscription_months: int, promo_code: str | None
+) -> None:
+    await _handle_yookassa(callback, user_id, locale, subscription_months, promo_code, "sbp")
+
+
+async def _handle_card(
+    callback: CallbackQuery, user_id: int, locale: str, subscription_months: int, promo_code: str | None
+) -> None:
+    await _handle_yookassa(callback, user_id, locale, subscription_months, promo_code, "card")
+
+
+async def _handle_promo_request(
+    callback: CallbackQuery, user_id: int, locale: str, subscription_months: int, promo_code: str | None
+) -> None:
+    """Запрашивает у пользователя промокод для выбранного тарифа."""
+    PENDING_INPUT[user_id] = f"{_PROMO_PENDING_PREFIX}{subscription_months}:all"
+    
+    months_text = _month_label(locale, subscription_months)
+    
+    await _edit_text_safe(
+        callback.message,
+        _("payment.enter_promo_code_text").format(months_text=months_text),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text=_("actions.cancel"),
+                callback_data=f"purchase:{subscription_months}"
+            )
+        ]])
+    )
+
+
+async def _handle_method_choice(
+    callback: CallbackQuery, user_id: int, locale: str, subscription_months: int, promo_code: str | None
+) -> None:
+    """Показывает выбор способа оплаты для тарифа."""
+    price, stars_price = get_settings().prices_for(subscription_months)
+    
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_("payment.payment_method_stars") + f" ({stars_price} ⭐)",
+                callback_data=f"purchase:{subscription_months}:stars"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_("payment.payment_method_sbp") + f" ({price:.0f} ₽)",
+                callback_data=f"purchase:{subscription_months}:sbp"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_("payment.payment_method_card") + f" ({price:.0f} ₽)",
+                callback_data=f"purchase:{subscription_months}:card"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_("payment.enter_promo_code"),
+                callback_data=f"purchase:{subscription_months}:promo"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_("user_menu.back"),
+                callback_data="user:buy"
+            )
+        ]
+    ]
+    
+    months_text = _month_label(locale, subscription_months)
+    
+    await _edit_text_safe(
+        callback.message,
+        _("payment.promo_code_prompt").format(
+            months_text=months_text,
+            stars=f"{price:.0f} ₽"
+        ),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+# Действие из callback_data -> обработчик; None — тариф выбран, но способ оплаты ещё нет
+_PURCHASE_ACTIONS = {
+    "stars": _handle_stars,
+    "sbp": _handle_sbp,
+    "card": _handle_card,
+    "promo": _handle_promo_request,
+    None: _handle_method_choice,
+}
 
 
 @router.callback_query(F.data.startswith("purchase:"))
 async def cb_purchase_subscription(callback: CallbackQuery) -> None:
     """Обрабатывает выбор тарифа - показывает выбор способа оплаты."""
-    await callback.answer()
+    ack = asyncio.create_task(callback.answer())
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
+    locale = await _get_user_locale(user_id, callback.from_user.username)
     
+    # Локаль выставляется на весь обработчик, включая ветку ошибки,
+    # и сбрасывается в том же finally, что и ожидание подтверждения
+    i18n = get_i18n()
+    locale_token = i18n.ctx_locale.set(locale)
     try:
-        parts = callback.data.split(":")
-        subscription_months = int(parts[1])
-        action = parts[2] if len(parts) > 2 else None
+        match = _CB_RE.match(callback.data)
+        handler = _PURCHASE_ACTIONS.get(match.group(2)) if match else None
+        if handler is None:
+            raise ValueError(f"Malformed purchase callback data: {callback.data!r}")
+        subscription_months = int(match.group(1))
+        promo_code = match.group(3) or None
         
-        i18n = get_i18n()
-        with i18n.use_locale(locale):
-            from src.config import get_settings
-            settings = get_settings()
-            
-            rub_prices = {
-                1: settings.subscription_rub_1month,
-                3: settings.subscription_rub_3months,
-                6: settings.subscription_rub_6months,
-                12: settings.subscription_rub_12months,
-            }
-            price = rub_prices.get(subscription_months, 0)
-            
-            # Если выбран способ оплаты, создаем платеж
-            if action in ("stars", "sbp", "card"):
-                payment_method = action
-                promo_code = parts[3] if len(parts) > 3 and parts[3] else None
-                
-                # Обработка Stars
-                if payment_method == "stars":
-                    from src.services.payment_service import create_subscription_invoice
-                    
-                    try:
-                        invoice_link = await create_subscription_invoice(
-                            bot=callback.message.bot,
-                            user_id=user_id,
-                            subscription_months=subscription_months,
-                            promo_code=promo_code
-                        )
-                        
-                        # Формируем текст с промокодом
-                        promo_text = ""
-                        if promo_code:
-                            promo = PromoCode.get(promo_code)
-                            if promo:
-                                if promo.get("discount_percent"):
-                                    promo_text = f"\n\n🎫 {_('user.promo_applied')}: {promo['discount_percent']}% {_('user.promo_discount')}"
-                                elif promo.get("bonus_days"):
-                                    promo_text = f"\n\n🎫 {_('user.promo_applied')}: +{promo['bonus_days']} {_('user.promo_bonus_days')}"
-                        
-                        buttons = [
-                            [
-                                InlineKeyboardButton(
-                                    text=_("payment.pay_button"),
-                                    url=invoice_link
-                                )
-                            ],
-                            [
-                                InlineKeyboardButton(
-                                    text=_("user_menu.back"),
-                                    callback_data="user:buy"
-                                )
-                            ]
-                        ]
-                        
-                        await _edit_text_safe(
-                            callback.message,
-                            _("payment.invoice_created") + promo_text,
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-                        )
-                    except Exception as e:
-                        logger.exception(f"Error creating Stars invoice: {e}")
-                        await _edit_text_safe(
-                            callback.message,
-                            _("payment.error_creating_invoice"),
-                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                                InlineKeyboardButton(
-                                    text=_("user_menu.back"),
-                                    callback_data="user:buy"
-                                )
-                            ]])
-                        )
-                    return
-                
-                # Обработка YooKassa (sbp, card)
-                if action in ("sbp", "card"):
-                
-                try:
-                    payment_data = await create_yookassa_payment(
-                        bot=callback.message.bot,
-                        user_id=user_id,
-                        subscription_months=subscription_months,
-                        promo_code=promo_code,
-                        payment_method=payment_method
-                    )
-                    
-                    payment_id = payment_data["payment_id"]
-                    confirmation_url = payment_data.get("confirmation_url")
-                    amount = payment_data.get("amount", 0)
-                    qr_code = payment_data.get("qr_code")
-                    
-                    # Отправляем QR-код для СБП
-                    if qr_code and payment_method == "sbp":
-                        await callback.message.answer_photo(
-                            BufferedInputFile(qr_code, filename="qr_code.png"),
-                            caption=_("payment.yookassa.qr_code_sent")
-                        )
-                    
-                    # Формируем текст с промокодом
-                    promo_text = ""
-                    if promo_code:
-                        promo = PromoCode.get(promo_code)
-                        if promo:
-                            if promo.get("discount_percent"):
-                                promo_text = f"\n\n🎫 {_('user.promo_applied')}: {promo['discount_percent']}% {_('user.promo_discount')}"
-                            elif promo.get("bonus_days"):
-                                promo_text = f"\n\n🎫 {_('user.promo_applied')}: +{promo['bonus_days']} {_('user.promo_bonus_days')}"
-                    
-                    text = _("payment.yookassa.payment_created").format(
-                        amount=f"{amount:.0f}",
-                        payment_id=payment_id[:16] + "..."
-                    ) + promo_text
-                    
-                    keyboard = get_yookassa_payment_keyboard(
-                        payment_id=payment_id,
-                        confirmation_url=confirmation_url
-                    )
-                    
-                    await _edit_text_safe(
-                        callback.message,
-                        text,
-                        reply_markup=keyboard,
-                        parse_mode="HTML"
-                    )
-                except ValueError as e:
-                    error_text = _("payment.error_creating_invoice")
-                    if "not configured" in str(e).lower():
-                        error_text += "\n\n⚠️ YooKassa не настроен. Проверьте YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY в .env"
-                    await _edit_text_safe(
-                        callback.message,
-                        error_text,
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                            InlineKeyboardButton(
-                                text=_("user_menu.back"),
-                                callback_data="user:buy"
-                            )
-                        ]])
-                    )
-                except Exception as e:
-                    logger.exception(f"Error creating YooKassa payment: {e}")
-                    await _edit_text_safe(
-                        callback.message,
-                        _("payment.error_creating_invoice"),
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                            InlineKeyboardButton(
-                                text=_("user_menu.back"),
-                                callback_data="user:buy"
-                            )
-                        ]])
-                    )
-                return
-            
-            # Если запрос промокода
-            if action == "promo":
-                PENDING_INPUT[user_id] = f"promo_for_purchase:{subscription_months}:all"
-                
-                locale_map = {
-                    1: _("payment.subscription_1month").split(" (")[0],
-                    3: _("payment.subscription_3months").split(" (")[0],
-                    6: _("payment.subscription_6months").split(" (")[0],
-                    12: _("payment.subscription_12months").split(" (")[0],
-                }
-                months_text = locale_map.get(subscription_months, f"{subscription_months} месяцев")
-                
-                await _edit_text_safe(
-                    callback.message,
-                    _("payment.enter_promo_code_text").format(months_text=months_text),
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                        InlineKeyboardButton(
-                            text=_("actions.cancel"),
-                            callback_data=f"purchase:{subscription_months}"
-                        )
-                    ]])
-                )
-                return
-            
-            # Получаем цены в Stars
-            stars_prices = {
-                1: settings.subscription_stars_1month,
-                3: settings.subscription_stars_3months,
-                6: settings.subscription_stars_6months,
-                12: settings.subscription_stars_12months,
-            }
-            stars_price = stars_prices.get(subscription_months, 0)
-            
-            # Показываем выбор способа оплаты
-            buttons = [
-                [
-                    InlineKeyboardButton(
-                        text=_("payment.payment_method_stars") + f" ({stars_price} ⭐)",
-                        callback_data=f"purchase:{subscription_months}:stars"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=_("payment.payment_method_sbp") + f" ({price:.0f} ₽)",
-                        callback_data=f"purchase:{subscription_months}:sbp"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=_("payment.payment_method_card") + f" ({price:.0f} ₽)",
-                        callback_data=f"purchase:{subscription_months}:card"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=_("payment.enter_promo_code"),
-                        callback_data=f"purchase:{subscription_months}:promo"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=_("user_menu.back"),
-                        callback_data="user:buy"
-                    )
-                ]
-            ]
-            
-            locale_map = {
-                1: _("payment.subscription_1month").split(" (")[0],
-                3: _("payment.subscription_3months").split(" (")[0],
-                6: _("payment.subscription_6months").split(" (")[0],
-                12: _("payment.subscription_12months").split(" (")[0],
-            }
-            months_text = locale_map.get(subscription_months, f"{subscription_months} месяцев")
-            
-            await _edit_text_safe(
-                callback.message,
-                _("payment.promo_code_prompt").format(
-                    months_text=months_text,
-                    stars=f"{price:.0f} ₽"
-                ),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-            )
+        await handler(callback, user_id, locale, subscription_months, promo_code)
     except Exception as e:
         logger.exception(f"Error in purchase handler: {e}")
         await callback.answer(_("payment.error_creating_invoice"), show_alert=True)
+    finally:
+        i18n.ctx_locale.reset(locale_token)
+        await ack
 
 
-@router.message(F.text.regexp(r'^[A-Za-z0-9]{3,20}$'))
+@router.message(PromoPendingFilter())
 async def handle_promo_code_input(message: Message) -> None:
     """Обрабатывает введенный промокод."""
-    from src.utils.auth import is_admin
-    
     user_id = message.from_user.id
     if is_admin(user_id):
         return
     
-    if user_id not in PENDING_INPUT:
-        return
-    
-    pending = PENDING_INPUT[user_id]
-    if not pending.startswith("promo_for_purchase:"):
+    pending = PENDING_INPUT.pop(user_id, None)
+    if pending is None:
+        # Запись успела устареть после проверки фильтром
         return
+    subscription_months = int(pending[len(_PROMO_PENDING_PREFIX):].partition(":")[0])
     
-    parts = pending.split(":")
-    subscription_months = int(parts[1])
-    del PENDING_INPUT[user_id]
-    
-    user = BotUser.get_or_create(user_id, message.from_user.username)
-    locale = user.get("language", "ru")
+    locale = await _get_user_locale(user_id, message.from_user.username)
     promo_code = message.text.upper()
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        can_use, error = PromoCode.can_use(promo_code)
+        promo, error = PromoCode.validate(promo_code)
         
-        if not can_use:
+        if promo is None:
             await message.answer(
                 error or _("user.promo_invalid"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back"),
-                        callback_data=f"purchase:{subscription_months}"
-                    )
-                ]])
+                reply_markup=_back_to_tariff_kb(locale, subscription_months)
             )
             return
         
         # Промокод валиден - показываем выбор способа оплаты с промокодом
-        from src.config import get_settings
-        settings = get_settings()
+        base_rub, base_stars = get_settings().prices_for(subscription_months)
         
-        # Получаем цены
-        stars_prices = {
-            1: settings.subscription_stars_1month,
-            3: settings.subscription_stars_3months,
-            6: settings.subscription_stars_6months,
-            12: settings.subscription_stars_12months,
-        }
-        rub_prices = {
-            1: settings.subscription_rub_1month,
-            3: settings.subscription_rub_3months,
-            6: settings.subscription_rub_6months,
-            12: settings.subscription_rub_12months,
-        }
-        base_stars = stars_prices.get(subscription_months, 0)
-        base_rub = rub_prices.get(subscription_months, 0)
+        # Применяем скидку (промокод уже получен при проверке)
+        # Доля к оплате в процентах: целочисленно, без накопления ошибки float
+        pay_percent = 100 - (promo.get("discount_percent") or 0)
+        final_stars = base_stars * pay_percent // 100
+        final_rub = base_rub * pay_percent / 100
         
-        # Применяем скидку
-        promo = PromoCode.get(promo_code)
-        discount_percent = promo.get("discount_percent", 0) if promo else 0
-        final_stars = int(base_stars * (1 - discount_percent / 100))
-        final_rub = base_rub * (1 - discount_percent / 100)
+        promo_text = _format_promo_text(locale, promo)
         
-        promo_text = ""
-        if promo:
-            if promo.get("discount_percent"):
-                promo_text = f"\n\n🎫 {_('user.promo_applied')}: {promo['discount_percent']}% {_('user.promo_discount')}"
-            elif promo.get("bonus_days"):
-                promo_text = f"\n\n🎫 {_('user.promo_applied')}: +{promo['bonus_days']} {_('user.promo_bonus_days')}"
-        
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("payment.payment_method_stars") + f" ({final_stars} ⭐)",
-                    callback_data=f"purchase:{subscription_months}:stars:{promo_code}"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("payment.payment_method_sbp") + f" ({final_rub:.0f} ₽)",
-                    callback_data=f"purchase:{subscription_months}:sbp:{promo_code}"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("payment.payment_method_card") + f" ({final_rub:.0f} ₽)",
-                    callback_data=f"purchase:{subscription_months}:card:{promo_code}"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data=f"purchase:{subscription_months}"
-                )
-            ]
-        ]
-        
-        locale_map = {
-            1: _("payment.subscription_1month").split(" (")[0],
-            3: _("payment.subscription_3months").split(" (")[0],
-            6: _("payment.subscription_6months").split(" (")[0],
-            12: _("payment.subscription_12months").split(" (")[0],
-        }
-        months_text = locale_map.get(subscription_months, f"{subscription_months} месяцев")
+        months_text = _month_label(locale, subscription_months)
         
         await message.answer(
             _("payment.promo_code_prompt").format(
                 months_text=months_text,
                 stars=f"{final_stars} ⭐ / {final_rub:.0f} ₽"
             ) + promo_text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+            reply_markup=_promo_methods_kb(locale, subscription_months, promo_code, final_stars, f"{final_rub:.0f}")
         )
 
@@ -1,8 +1,10 @@
 """Глобальное состояние бота для хранения данных между запросами."""
+from src.utils.cache import TTLCache
 
-# Словарь для хранения ожидаемого ввода от пользователей
-# Ключ: user_id, Значение: dict с информацией о текущем действии
-PENDING_INPUT: dict[int, dict] = {}
+# Ожидаемый ввод от пользователей. Брошенные диалоги (например, запрос промокода)
+# устаревают сами, поэтому словарь не растет бесконечно.
+# Ключ: user_id, Значение: dict с информацией о текущем действии (или строка для промокода)
+PENDING_INPUT: TTLCache = TTLCache(maxsize=10_000, ttl=600)
 
 # Словарь для хранения ID последних сообщений бота в каждом чате
 # Ключ: chat_id, Значение: message_id
@@ -20,6 +22,10 @@ USER_DETAIL_BACK_TARGET: dict[int, str] = {}
 # Ключ: user_id, Значение: номер страницы (int)
 SUBS_PAGE_BY_USER: dict[int, int] = {}
 
+# Кэш языка пользователей, чтобы не ходить в БД ради одного поля
+# Ключ: user_id, Значение: код локали
+USER_LOCALES: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+
 # Константы
 ADMIN_COMMAND_DELETE_DELAY = 2.0
 SEARCH_PAGE_SIZE = 100
@@ -1,79 +1,150 @@
 """Обработчики для публичных пользователей (не админов)."""
+import asyncio
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
 
 from aiogram import F, Router
+from aiogram.exceptions import TelegramAPIError
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.utils.i18n import gettext as _
 
+from src.config import get_settings
 from src.database import BotUser, PromoCode, Referral, Payment
-from src.services.api_client import NotFoundError, api_client
+from src.services.api_client import ApiClientError, NotFoundError, api_client
+from src.services.notification_service import notify_referral_bonus, notify_trial_activation
+from src.services.referral_service import grant_referral_bonus
 from src.handlers.common import _edit_text_safe
+from src.handlers.navigation import _fetch_main_menu_text
+from src.handlers.state import USER_LOCALES
+from src.keyboards.main_menu import main_menu_keyboard
+from src.utils.auth import is_admin
+from src.utils.cache import TTLCache
+from src.utils.formatters import REMNAWAVE_TS_FORMAT, format_bytes, parse_remnawave_ts
 from src.utils.i18n import get_i18n
 from src.utils.logger import logger
+from src.utils.user_loader import UserLoaderMiddleware
+
+# Максимальная длина username в Remnawave
+_REMNAWAVE_USERNAME_MAX = 36
+
+# Ответы /api/sub/{shortUuid}/info по shortUuid: отсюда берется только ссылка на подписку,
+# которая меняется вместе с shortUuid, поэтому её можно держать дольше остальных данных.
+_subscription_info_cache: TTLCache = TTLCache(maxsize=1024, ttl=300)
 
 router = Router(name="user_public")
+# Пользователь загружается из БД один раз на апдейт и передается в обработчики как user/locale
+router.message.middleware(UserLoaderMiddleware())
+router.callback_query.middleware(UserLoaderMiddleware())
+
+
+@lru_cache(maxsize=1024)
+def _format_expire(expire_at: str) -> str:
+    """Дата окончания подписки для экрана; нераспознанное значение выводится как есть.
+    
+    expireAt у пользователя меняется только при продлении, а экран открывают
+    повторно, поэтому результат кэшируется по исходной строке.
+    """
+    try:
+        return parse_remnawave_ts(expire_at).strftime("%d.%m.%Y %H:%M")
+    except ValueError:
+        return expire_at
+
+
+@lru_cache(maxsize=4096)
+def _tr(locale: str, key: str) -> str:
+    """Перевод ключа для локали; каталоги не меняются во время работы, поэтому кэшируется."""
+    return get_i18n().gettext(key, locale=locale)
+
+
+# Статусы Remnawave, для которых есть перевод (<раздел>.status_<статус>)
+_KNOWN_STATUSES = frozenset({"ACTIVE", "DISABLED", "LIMITED", "EXPIRED"})
+
+
+@lru_cache(maxsize=64)
+def _status_label(locale: str, section: str, status: str) -> str:
+    """Подпись статуса подписки; неизвестный статус выводится как есть."""
+    if status not in _KNOWN_STATUSES:
+        return status
+    return _tr(locale, f"{section}.status_{status.lower()}")
+
+
+# Склонения для тарифов бота; остальные значения собираются в _get_months_text
+_MONTHS_TEXT = {
+    ("ru", 1): "1 месяц",
+    ("ru", 3): "3 месяца",
+    ("ru", 6): "6 месяцев",
+    ("ru", 12): "12 месяцев",
+    ("en", 1): "1 month",
+    ("en", 3): "3 months",
+    ("en", 6): "6 months",
+    ("en", 12): "12 months",
+}
 
 
 def _get_months_text(months: int, locale: str) -> str:
     """Возвращает правильное склонение месяцев для русского языка."""
+    text = _MONTHS_TEXT.get((locale, months))
+    if text is not None:
+        return text
     if locale == "ru":
-        if months == 1:
-            return "1 месяц"
-        elif months in (2, 3, 4):
+        if months % 10 == 1 and months % 100 != 11:
+            return f"{months} месяц"
+        if months % 10 in (2, 3, 4) and months % 100 not in (12, 13, 14):
             return f"{months} месяца"
-        else:
-            return f"{months} месяцев"
-    else:
-        # Для английского
-        if months == 1:
-            return "1 month"
-        else:
-            return f"{months} months"
+        return f"{months} месяцев"
+    # Для английского
+    return "1 month" if months == 1 else f"{months} months"
 
 
-def _get_user_menu_keyboard(user_id: int) -> InlineKeyboardMarkup:
-    """Создает клавиатуру главного меню пользователя."""
-    from src.utils.auth import is_admin
+@lru_cache(maxsize=16)
+def _user_menu_markup(locale: str, with_admin: bool) -> InlineKeyboardMarkup:
+    """Клавиатура главного меню пользователя для указанной локали."""
     buttons = [
         # 1️⃣ Подключить доступ — главное действие → отдельная строка
         [
             InlineKeyboardButton(
-                text=_("user_menu.connect"),
+                text=_tr(locale, "user_menu.connect"),
                 callback_data="user:connect"
             )
         ],
         # 2️⃣ Мой доступ / Настройки — вторичные → в одной строке
         [
             InlineKeyboardButton(
-                text=_("user_menu.my_access"),
+                text=_tr(locale, "user_menu.my_access"),
                 callback_data="user:my_access"
             ),
             InlineKeyboardButton(
-                text=_("user_menu.settings"),
+                text=_tr(locale, "user_menu.settings"),
                 callback_data="user:settings"
             )
         ],
         # 3️⃣ Поддержка — редко → отдельно
         [
             InlineKeyboardButton(
-                text=_("user_menu.support"),
+                text=_tr(locale, "user_menu.support"),
                 callback_data="user:support"
             )
         ]
     ]
     # 4️⃣ Админка — только для админа, отдельно
-    if is_admin(user_id):
+    if with_admin:
         buttons.append([
             InlineKeyboardButton(
-                text=_("user_menu.admin_panel"),
+                text=_tr(locale, "user_menu.admin_panel"),
                 callback_data="admin:panel",
             )
         ])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def _get_user_menu_keyboard(user_id: int, locale: str) -> InlineKeyboardMarkup:
+    """Возвращает клавиатуру главного меню пользователя."""
+    return _user_menu_markup(locale, is_admin(user_id))
+
+
+@lru_cache(maxsize=1)
 def _get_language_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура выбора языка."""
     buttons = [
@@ -85,831 +156,791 @@ def _get_language_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=16)
+def _language_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура выбора языка с возвратом в настройки."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        *_get_language_keyboard().inline_keyboard,
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:settings"
+            )
+        ]
+    ])
+
+
+@lru_cache(maxsize=16)
+def _back_to_menu_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой возврата в меню пользователя."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text=_tr(locale, "user_menu.back"),
+            callback_data="user:menu"
+        )
+    ]])
+
+
+@lru_cache(maxsize=16)
+def _connect_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура раздела "Подключить доступ": покупка / пробный период / назад."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "connect.buy_subscription"),
+                callback_data="user:buy"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "connect.trial"),
+                callback_data="user:trial"
+            )
+        ],
+        *_back_to_menu_keyboard(locale).inline_keyboard,
+    ])
+
+
+@lru_cache(maxsize=16)
+def _back_to_connect_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой возврата в раздел "Подключить доступ"."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=_tr(locale, "user_menu.back"), callback_data="user:connect")
+    ]])
+
+
+@lru_cache(maxsize=16)
+def _renew_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура продления/возобновления доступа: купить подписку / назад."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.buy_subscription"),
+                callback_data="user:buy"
+            )
+        ],
+        *_back_to_menu_keyboard(locale).inline_keyboard,
+    ])
+
+
+@lru_cache(maxsize=16)
+def _no_access_keyboard(locale: str) -> InlineKeyboardMarkup:
+    """Клавиатура для пользователя без доступа: подключить / назад."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.connect"),
+                callback_data="user:connect"
+            )
+        ],
+        *_back_to_menu_keyboard(locale).inline_keyboard,
+    ])
+
+
+def _subscription_info_text(
+    locale: str,
+    status_text: str,
+    expire_at: str | None,
+    traffic_used: int,
+    traffic_limit: int,
+    subscription_url: str,
+) -> str:
+    """Текст карточки подписки (экраны "Мой доступ" и "Подписка")."""
+    # trafficLimit == 0 в Remnawave означает безлимит
+    limit_text = format_bytes(traffic_limit) if traffic_limit else "∞"
+    return _tr(locale, "user.subscription_info").format_map({
+        "status": status_text,
+        "expire": _format_expire(expire_at) if expire_at else _tr(locale, "user.no_expire"),
+        "traffic": f"{format_bytes(traffic_used)} / {limit_text}",
+        "url": subscription_url or _tr(locale, "user.no_url"),
+    })
+
+
+async def _get_subscription_info(short_uuid: str) -> dict:
+    """Возвращает информацию о подписке, используя кэш по shortUuid."""
+    sub_info = _subscription_info_cache.get(short_uuid)
+    if sub_info is None:
+        sub_info = await api_client.get_subscription_info(short_uuid)
+        _subscription_info_cache[short_uuid] = sub_info
+    return sub_info
+
+
+async def _load_remnawave_user(user: dict) -> tuple[dict, dict | Exception | None]:
+    """Загружает пользователя Remnawave и его подписку.
+
+    Если shortUuid уже сохранен в БД, оба запроса выполняются параллельно.
+    Ошибка запроса подписки не пробрасывается, а возвращается вместо её данных;
+    None означает, что у пользователя нет shortUuid.
+    """
+    remnawave_uuid = user["remnawave_user_uuid"]
+    stored_short_uuid = user.get("remnawave_short_uuid")
+    sub_info = None
+    if stored_short_uuid:
+        user_data, sub_info = await asyncio.gather(
+            api_client.get_user_by_uuid(remnawave_uuid),
+            _get_subscription_info(stored_short_uuid),
+            return_exceptions=True,
+        )
+        if isinstance(user_data, Exception):
+            raise user_data
+    else:
+        user_data = await api_client.get_user_by_uuid(remnawave_uuid)
+    info = user_data.get("response", user_data)
+
+    short_uuid = info.get("shortUuid")
+    if short_uuid == stored_short_uuid:
+        return info, sub_info
+    # shortUuid еще не сохранен или сменился (например, после сброса подписки)
+    BotUser.set_remnawave_short_uuid(user["telegram_id"], short_uuid)
+    if not short_uuid:
+        return info, None
+    try:
+        sub_info = await _get_subscription_info(short_uuid)
+    except Exception as e:
+        sub_info = e
+    return info, sub_info
+
+
+def _missing_squads(info: dict, external_squad_uuid: str | None, internal_squads: list | None) -> dict:
+    """Возвращает поля update_user для сквадов, которые create_user не применил.
+    
+    activeInternalSquads в ответе Remnawave — список объектов с uuid (или строк).
+    """
+    payload = {}
+    if external_squad_uuid and info.get("externalSquadUuid") != external_squad_uuid:
+        payload["externalSquadUuid"] = external_squad_uuid
+    if internal_squads:
+        applied = {
+            squad.get("uuid") if isinstance(squad, dict) else squad
+            for squad in info.get("activeInternalSquads") or []
+        }
+        if applied != set(internal_squads):
+            payload["activeInternalSquads"] = internal_squads
+    return payload
+
+
+async def _apply_trial_squads(user_uuid: str, update_payload: dict) -> None:
+    """Применяет сквады к триальному пользователю; ошибки только логируются."""
+    if not update_payload:
+        return
+    try:
+        await api_client.update_user(user_uuid, **update_payload)
+        logger.info(
+            "Applied squads on trial user %s: external=%s, internal=%s",
+            user_uuid,
+            update_payload.get("externalSquadUuid"),
+            update_payload.get("activeInternalSquads")
+        )
+    except Exception as squad_exc:
+        logger.warning("Failed to apply squads on trial user %s: %s", user_uuid, squad_exc)
+
+
+async def _fetch_subscription_url(short_uuid: str | None) -> str:
+    """Возвращает ссылку на подписку или пустую строку, если её не удалось получить."""
+    if not short_uuid:
+        return ""
+    try:
+        sub_info = await _get_subscription_info(short_uuid)
+    except Exception:
+        return ""
+    sub_data = sub_info.get("response", sub_info)
+    return sub_data.get("subscriptionUrl", "") or ""
+
+
 @router.message(Command("start"))
-async def cmd_start(message: Message) -> None:
+async def cmd_start(message: Message, locale: str) -> None:
     """Обработчик команды /start для всех пользователей."""
     user_id = message.from_user.id
-    username = message.from_user.username
-
-    # Получаем или создаем пользователя
-    user = BotUser.get_or_create(user_id, username)
-    locale = user.get("language", "ru")
     
-    # Устанавливаем локализацию
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        # Проверяем, есть ли реферальный код
-        args = message.text.split()[1:] if message.text and len(message.text.split()) > 1 else []
-        
-        if args:
-            try:
-                referrer_id = int(args[0])
-                if referrer_id != user_id:
-                    BotUser.set_referrer(user_id, referrer_id)
-                    Referral.create(referrer_id, user_id)
-                    welcome_text = _("user.welcome_with_referral")
-            except (ValueError, IndexError):
-                welcome_text = _("user.welcome")
-        else:
-            welcome_text = _("user.welcome")
-        
-        await message.answer(
-            welcome_text,
-            reply_markup=_get_user_menu_keyboard(user_id)
-        )
+    welcome_text = _tr(locale, "user.welcome")
+    
+    # Проверяем, есть ли реферальный код (первый аргумент после /start)
+    parts = (message.text or "").split(maxsplit=2)
+    referrer_arg = parts[1] if len(parts) > 1 else None
+    
+    if referrer_arg:
+        try:
+            referrer_id = int(referrer_arg)
+        except ValueError:
+            referrer_id = None
+        if referrer_id is not None and referrer_id != user_id:
+            BotUser.set_referrer(user_id, referrer_id)
+            Referral.create(referrer_id, user_id)
+            welcome_text = _tr(locale, "user.welcome_with_referral")
+    
+    await message.answer(
+        welcome_text,
+        reply_markup=_get_user_menu_keyboard(user_id, locale)
+    )
 
 
 @router.callback_query(F.data == "admin:panel")
 async def cb_admin_panel(callback: CallbackQuery) -> None:
     """Открывает админ-панель (только для админов)."""
-    from src.utils.auth import is_admin
-    from src.handlers.navigation import _fetch_main_menu_text
-    from src.keyboards.main_menu import main_menu_keyboard
-
-    await callback.answer()
     if not is_admin(callback.from_user.id):
-        # Защита на всякий случай (middleware тоже блокирует)
-        await callback.answer(_("errors.unauthorized"), show_alert=True)
+        # Защита на всякий случай (middleware тоже блокирует).
+        # На callback уже ответил UserLoaderMiddleware, поэтому пишем сообщением.
+        await callback.message.answer(_("errors.unauthorized"))
         return
 
     menu_text = await _fetch_main_menu_text()
-    await callback.message.edit_text(menu_text, reply_markup=main_menu_keyboard())
+    await _edit_text_safe(callback.message, menu_text, reply_markup=main_menu_keyboard())
 
 
 @router.callback_query(F.data == "user:menu")
-async def cb_user_menu(callback: CallbackQuery) -> None:
+async def cb_user_menu(callback: CallbackQuery, locale: str) -> None:
     """Показывает главное меню пользователя."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        # Показываем приветственный текст как при /start
-        welcome_text = _("user.welcome")
-        await callback.message.edit_text(
-            welcome_text,
-            reply_markup=_get_user_menu_keyboard(user_id)
-        )
+    # Показываем приветственный текст как при /start
+    welcome_text = _tr(locale, "user.welcome")
+    await _edit_text_safe(
+        callback.message,
+        welcome_text,
+        reply_markup=_get_user_menu_keyboard(user_id, locale)
+    )
 
 
 @router.callback_query(F.data == "user:language")
-async def cb_language(callback: CallbackQuery) -> None:
+async def cb_language(callback: CallbackQuery, locale: str) -> None:
     """Обработчик выбора языка."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
-    
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang:ru"),
-                InlineKeyboardButton(text="🇬🇧 English", callback_data="lang:en")
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:settings"
-                )
-            ]
-        ]
-        await callback.message.edit_text(
-            _("user.choose_language"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "user.choose_language"),
+        reply_markup=_language_keyboard(locale)
+    )
 
 
 @router.callback_query(F.data.startswith("lang:"))
 async def cb_set_language(callback: CallbackQuery) -> None:
     """Устанавливает язык пользователя."""
-    await callback.answer()
-    language = callback.data.split(":")[1]
+    language = callback.data.partition(":")[2]
     user_id = callback.from_user.id
     
     BotUser.update_language(user_id, language)
+    USER_LOCALES[user_id] = language
     
     i18n = get_i18n()
     with i18n.use_locale(language):
         buttons = [
             [
                 InlineKeyboardButton(
-                    text=_("settings.language"),
+                    text=_tr(language, "settings.language"),
                     callback_data="user:language"
                 )
             ],
             [
                 InlineKeyboardButton(
-                    text=_("settings.referral"),
+                    text=_tr(language, "settings.referral"),
                     callback_data="user:referral"
                 )
             ],
             [
                 InlineKeyboardButton(
-                    text=_("user_menu.back"),
+                    text=_tr(language, "user_menu.back"),
                     callback_data="user:menu"
                 )
             ]
         ]
-        await callback.message.edit_text(
-            _("user.language_changed"),
+        await _edit_text_safe(
+            callback.message,
+            _tr(language, "user.language_changed"),
             reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
         )
 
 
 @router.callback_query(F.data == "user:connect")
-async def cb_connect(callback: CallbackQuery) -> None:
+async def cb_connect(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Подключить доступ'."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("connect.buy_subscription"),
-                    callback_data="user:buy"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("connect.trial"),
-                    callback_data="user:trial"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:menu"
-                )
-            ]
-        ]
-        await callback.message.edit_text(
-            _("connect.title"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "connect.title"),
+        reply_markup=_connect_keyboard(locale)
+    )
 
 
 @router.callback_query(F.data == "user:my_access")
-async def cb_my_access(callback: CallbackQuery) -> None:
+async def cb_my_access(callback: CallbackQuery, user: dict, locale: str) -> None:
     """Обработчик 'Мой доступ' - показывает статус подписки."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        # Показываем сообщение "Проверяем статус доступа…"
-        await callback.message.edit_text(_("my_access.checking_status"))
+    # Показываем сообщение "Проверяем статус доступа…"
+    await callback.message.edit_text(_tr(locale, "my_access.checking_status"))
+    
+    remnawave_uuid = user.get("remnawave_user_uuid")
+    
+    if not remnawave_uuid:
+        await callback.message.edit_text(
+            _tr(locale, "my_access.no_access"),
+            reply_markup=_no_access_keyboard(locale)
+        )
+        return
+    
+    try:
+        # Получаем информацию о пользователе и подписку из Remnawave
+        info, sub_info = await _load_remnawave_user(user)
+        subscription_url = ""
+        if isinstance(sub_info, dict):
+            sub_data = sub_info.get("response", sub_info)
+            subscription_url = sub_data.get("subscriptionUrl", "")
         
-        remnawave_uuid = user.get("remnawave_user_uuid")
+        # Формируем текст
+        status = info.get("status", "UNKNOWN")
+        expire_at = info.get("expireAt")
+        traffic_used = info.get("trafficUsed", 0)
+        traffic_limit = info.get("trafficLimit", 0)
         
-        if not remnawave_uuid:
-            buttons = [
-                [
-                    InlineKeyboardButton(
-                        text=_("user_menu.connect"),
-                        callback_data="user:connect"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=_("user_menu.back"),
-                        callback_data="user:menu"
-                    )
-                ]
-            ]
-            await callback.message.edit_text(
-                _("my_access.no_access"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-            )
-            return
+        status_text = _status_label(locale, "my_access", status)
         
-        try:
-            # Получаем информацию о пользователе из Remnawave
-            user_data = await api_client.get_user_by_uuid(remnawave_uuid)
-            info = user_data.get("response", user_data)
-            
-            # Получаем подписку
-            short_uuid = info.get("shortUuid")
-            subscription_url = ""
-            if short_uuid:
-                try:
-                    sub_info = await api_client.get_subscription_info(short_uuid)
-                    sub_data = sub_info.get("response", sub_info)
-                    subscription_url = sub_data.get("subscriptionUrl", "")
-                except:
-                    pass
-            
-            # Формируем текст
-            status = info.get("status", "UNKNOWN")
-            expire_at = info.get("expireAt")
-            traffic_used = info.get("trafficUsed", 0)
-            traffic_limit = info.get("trafficLimit", 0)
-            
-            status_text = {
-                "ACTIVE": _("my_access.status_active", locale=locale),
-                "DISABLED": _("my_access.status_disabled", locale=locale),
-                "LIMITED": _("my_access.status_limited", locale=locale),
-                "EXPIRED": _("my_access.status_expired", locale=locale),
-            }.get(status, status)
-            
-            expire_text = ""
-            if expire_at:
-                try:
-                    expire_dt = datetime.fromisoformat(expire_at.replace("Z", "+00:00"))
-                    expire_text = expire_dt.strftime("%d.%m.%Y %H:%M")
-                except:
-                    expire_text = expire_at
-            
-            from src.utils.formatters import format_bytes
-            traffic_text = f"{format_bytes(traffic_used)} / {format_bytes(traffic_limit)}"
-            
-            text = _("user.subscription_info", locale=locale).format(
-                status=status_text,
-                expire=expire_text or _("user.no_expire", locale=locale),
-                traffic=traffic_text,
-                url=subscription_url or _("user.no_url", locale=locale)
-            )
-            
-            keyboard_buttons = []
-            
-            if subscription_url:
-                keyboard_buttons.append([
-                    InlineKeyboardButton(
-                        text=_("user.get_config", locale=locale),
-                        url=subscription_url
-                    )
-                ])
-            
+        text = _subscription_info_text(
+            locale, status_text, expire_at, traffic_used, traffic_limit, subscription_url
+        )
+        
+        keyboard_buttons = []
+        
+        if subscription_url:
             keyboard_buttons.append([
                 InlineKeyboardButton(
-                    text=_("user_menu.back", locale=locale),
-                    callback_data="user:menu"
+                    text=_tr(locale, "user.get_config"),
+                    url=subscription_url
                 )
             ])
-            
-            await callback.message.edit_text(
-                text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
-                parse_mode="HTML"
-            )
-        except NotFoundError:
-            buttons = [
-                [
-                    InlineKeyboardButton(
-                        text=_("user_menu.connect", locale=locale),
-                        callback_data="user:connect"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
-                        callback_data="user:menu"
-                    )
-                ]
-            ]
-            await callback.message.edit_text(
-                _("my_access.no_access", locale=locale),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-            )
-        except Exception as e:
-            logger.exception(f"Error getting subscription info for user {user_id}, uuid {remnawave_uuid}: {e}")
-            error_msg = str(e)
-            if "404" in error_msg or "not found" in error_msg.lower():
-                error_text = _("my_access.no_access", locale=locale)
-            else:
-                error_text = _("errors.generic", locale=locale) + f"\n\nОшибка: {error_msg[:100]}"
-            
-            buttons = [
-                [
-                    InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
-                        callback_data="user:menu"
-                    )
-                ]
-            ]
-            await callback.message.edit_text(
-                error_text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+        
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:menu"
             )
+        ])
+        
+        await callback.message.edit_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
+            parse_mode="HTML"
+        )
+    except NotFoundError:
+        await callback.message.edit_text(
+            _tr(locale, "my_access.no_access"),
+            reply_markup=_no_access_keyboard(locale)
+        )
+    except ApiClientError as e:
+        # Ожидаемая ошибка API (таймаут, 5xx, проблемы сети) — без traceback
+        logger.warning(
+            "Remnawave error getting subscription info for user %s, uuid %s: %r (%r)",
+            user_id, remnawave_uuid, e, e.__cause__
+        )
+        await callback.message.edit_text(
+            _tr(locale, "errors.generic"),
+            reply_markup=_back_to_menu_keyboard(locale)
+        )
+    except Exception as e:
+        logger.exception("Error getting subscription info for user %s, uuid %s: %s", user_id, remnawave_uuid, e)
+        error_msg = str(e)
+        if "404" in error_msg or "not found" in error_msg.lower():
+            error_text = _tr(locale, "my_access.no_access")
+        else:
+            error_text = _tr(locale, "errors.generic") + f"\n\nОшибка: {error_msg[:100]}"
+        
+        await callback.message.edit_text(
+            error_text,
+            reply_markup=_back_to_menu_keyboard(locale)
+        )
 
 
 @router.callback_query(F.data == "user:settings")
-async def cb_settings(callback: CallbackQuery) -> None:
+async def cb_settings(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Настройки'."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     auto_renewal = BotUser.get_auto_renewal(user_id)
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        # Определяем текст для кнопки автопродления
-        auto_renewal_text = _("settings.auto_renewal_on") if auto_renewal else _("settings.auto_renewal_off")
-        
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=auto_renewal_text,
-                    callback_data="user:auto_renewal"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("settings.language"),
-                    callback_data="user:language"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("settings.referral"),
-                    callback_data="user:referral"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("settings.documents"),
-                    callback_data="user:documents"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:menu"
-                )
-            ]
+    # Определяем текст для кнопки автопродления
+    auto_renewal_text = _tr(locale, "settings.auto_renewal_on") if auto_renewal else _tr(locale, "settings.auto_renewal_off")
+    
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=auto_renewal_text,
+                callback_data="user:auto_renewal"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "settings.language"),
+                callback_data="user:language"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "settings.referral"),
+                callback_data="user:referral"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "settings.documents"),
+                callback_data="user:documents"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:menu"
+            )
         ]
-        await callback.message.edit_text(
-            _("settings.title"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    ]
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "settings.title"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
 
 
 @router.callback_query(F.data == "user:support")
-async def cb_support(callback: CallbackQuery) -> None:
+async def cb_support(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Поддержка'."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:menu"
-                )
-            ]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:menu"
+            )
         ]
-        await callback.message.edit_text(
-            _("support.title"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    ]
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "support.title"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
 
 
 @router.callback_query(F.data == "user:documents")
-async def cb_documents(callback: CallbackQuery) -> None:
+async def cb_documents(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Документы'."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("documents.privacy"),
-                    callback_data="user:documents:privacy"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("documents.offer"),
-                    callback_data="user:documents:offer"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("documents.rules"),
-                    callback_data="user:documents:rules"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:settings"
-                )
-            ]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "documents.privacy"),
+                callback_data="user:documents:privacy"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "documents.offer"),
+                callback_data="user:documents:offer"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "documents.rules"),
+                callback_data="user:documents:rules"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:settings"
+            )
         ]
-        await callback.message.edit_text(
-            _("documents.title"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    ]
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "documents.title"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
 
 
 @router.callback_query(F.data == "user:documents:privacy")
-async def cb_documents_privacy(callback: CallbackQuery) -> None:
+async def cb_documents_privacy(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Политика конфиденциальности'."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:documents"
-                )
-            ]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:documents"
+            )
         ]
-        await callback.message.edit_text(
-            _("documents.privacy_content"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-            parse_mode="HTML"
-        )
+    ]
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "documents.privacy_content"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        parse_mode="HTML"
+    )
 
 
 @router.callback_query(F.data == "user:documents:offer")
-async def cb_documents_offer(callback: CallbackQuery) -> None:
+async def cb_documents_offer(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Публичная оферта'."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:documents"
-                )
-            ]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:documents"
+            )
         ]
-        await callback.message.edit_text(
-            _("documents.offer_content"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-            parse_mode="HTML"
-        )
+    ]
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "documents.offer_content"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        parse_mode="HTML"
+    )
 
 
 @router.callback_query(F.data == "user:documents:rules")
-async def cb_documents_rules(callback: CallbackQuery) -> None:
+async def cb_documents_rules(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Правила использования сервиса'."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:documents"
-                )
-            ]
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:documents"
+            )
         ]
-        await callback.message.edit_text(
-            _("documents.rules_content"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-            parse_mode="HTML"
-        )
+    ]
+    await _edit_text_safe(
+        callback.message,
+        _tr(locale, "documents.rules_content"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        parse_mode="HTML"
+    )
 
 
 @router.callback_query(F.data == "user:subscription")
-async def cb_subscription(callback: CallbackQuery) -> None:
+async def cb_subscription(callback: CallbackQuery, user: dict, locale: str) -> None:
     """Показывает информацию о подписке пользователя."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        remnawave_uuid = user.get("remnawave_user_uuid")
+    remnawave_uuid = user.get("remnawave_user_uuid")
+    
+    if not remnawave_uuid:
+        await callback.message.edit_text(
+            _tr(locale, "user.no_subscription"),
+            reply_markup=_back_to_menu_keyboard(locale)
+        )
+        return
+    
+    try:
+        # Получаем информацию о пользователе и подписку из Remnawave
+        info, sub_info = await _load_remnawave_user(user)
+        if isinstance(sub_info, Exception):
+            raise sub_info
+        if sub_info:
+            sub_data = sub_info.get("response", sub_info)
+            subscription_url = sub_data.get("subscriptionUrl", "")
+        else:
+            subscription_url = ""
         
-        if not remnawave_uuid:
-            await callback.message.edit_text(
-                _("user.no_subscription"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
-                        callback_data="user:menu"
-                    )
-                ]])
-            )
-            return
+        # Формируем текст
+        status = info.get("status", "UNKNOWN")
+        expire_at = info.get("expireAt")
+        traffic_used = info.get("trafficUsed", 0)
+        traffic_limit = info.get("trafficLimit", 0)
         
-        try:
-            # Получаем информацию о пользователе из Remnawave
-            user_data = await api_client.get_user_by_uuid(remnawave_uuid)
-            info = user_data.get("response", user_data)
-            
-            # Получаем подписку
-            short_uuid = info.get("shortUuid")
-            if short_uuid:
-                sub_info = await api_client.get_subscription_info(short_uuid)
-                sub_data = sub_info.get("response", sub_info)
-                subscription_url = sub_data.get("subscriptionUrl", "")
-            else:
-                subscription_url = ""
-            
-            # Формируем текст
-            status = info.get("status", "UNKNOWN")
-            expire_at = info.get("expireAt")
-            traffic_used = info.get("trafficUsed", 0)
-            traffic_limit = info.get("trafficLimit", 0)
-            
-            status_text = {
-                "ACTIVE": _("user.status_active", locale=locale),
-                "DISABLED": _("user.status_disabled", locale=locale),
-                "LIMITED": _("user.status_limited", locale=locale),
-                "EXPIRED": _("user.status_expired", locale=locale),
-            }.get(status, status)
-            
-            expire_text = ""
-            if expire_at:
-                try:
-                    expire_dt = datetime.fromisoformat(expire_at.replace("Z", "+00:00"))
-                    expire_text = expire_dt.strftime("%d.%m.%Y %H:%M")
-                except:
-                    expire_text = expire_at
-            
-            from src.utils.formatters import format_bytes
-            traffic_text = f"{format_bytes(traffic_used)} / {format_bytes(traffic_limit)}"
-            
-            text = _("user.subscription_info", locale=locale).format(
-                status=status_text,
-                expire=expire_text or _("user.no_expire", locale=locale),
-                traffic=traffic_text,
-                url=subscription_url or _("user.no_url", locale=locale)
-            )
-            
-            keyboard_buttons = []
-            
-            if subscription_url:
-                keyboard_buttons.append([
-                    InlineKeyboardButton(
-                        text=_("user.get_config", locale=locale),
-                        url=subscription_url
-                    )
-                ])
-            
+        status_text = _status_label(locale, "user", status)
+        
+        text = _subscription_info_text(
+            locale, status_text, expire_at, traffic_used, traffic_limit, subscription_url
+        )
+        
+        keyboard_buttons = []
+        
+        if subscription_url:
             keyboard_buttons.append([
                 InlineKeyboardButton(
-                    text=_("user_menu.back", locale=locale),
-                    callback_data="user:menu"
+                    text=_tr(locale, "user.get_config"),
+                    url=subscription_url
                 )
             ])
-            
-            await callback.message.edit_text(
-                text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
-                parse_mode="HTML"
-            )
-        except NotFoundError:
-            await callback.message.edit_text(
-                _("user.subscription_not_found", locale=locale),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
-                        callback_data="user:menu"
-                    )
-                ]])
-            )
-        except Exception as e:
-            logger.exception(f"Error getting subscription info for user {user_id}, uuid {remnawave_uuid}: {e}")
-            error_msg = str(e)
-            # Более информативное сообщение об ошибке
-            if "404" in error_msg or "not found" in error_msg.lower():
-                error_text = _("user.subscription_not_found", locale=locale)
-            else:
-                error_text = _("errors.generic", locale=locale) + f"\n\nОшибка: {error_msg[:100]}"
-            
-            await callback.message.edit_text(
-                error_text,
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
-                        callback_data="user:menu"
-                    )
-                ]])
+        
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:menu"
             )
+        ])
+        
+        await callback.message.edit_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
+            parse_mode="HTML"
+        )
+    except NotFoundError:
+        await callback.message.edit_text(
+            _tr(locale, "user.subscription_not_found"),
+            reply_markup=_back_to_menu_keyboard(locale)
+        )
+    except ApiClientError as e:
+        # Ожидаемая ошибка API (таймаут, 5xx, проблемы сети) — без traceback
+        logger.warning(
+            "Remnawave error getting subscription info for user %s, uuid %s: %r (%r)",
+            user_id, remnawave_uuid, e, e.__cause__
+        )
+        await callback.message.edit_text(
+            _tr(locale, "errors.generic"),
+            reply_markup=_back_to_menu_keyboard(locale)
+        )
+    except Exception as e:
+        logger.exception("Error getting subscription info for user %s, uuid %s: %s", user_id, remnawave_uuid, e)
+        error_msg = str(e)
+        # Более информативное сообщение об ошибке
+        if "404" in error_msg or "not found" in error_msg.lower():
+            error_text = _tr(locale, "user.subscription_not_found")
+        else:
+            error_text = _tr(locale, "errors.generic") + f"\n\nОшибка: {error_msg[:100]}"
+        
+        await callback.message.edit_text(
+            error_text,
+            reply_markup=_back_to_menu_keyboard(locale)
+        )
 
 
 @router.callback_query(F.data == "user:trial")
-async def cb_trial(callback: CallbackQuery) -> None:
+async def cb_trial(callback: CallbackQuery, user: dict, locale: str) -> None:
     """Обработчик пробной подписки."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        if user.get("trial_used"):
-            await callback.message.edit_text(
-                _("user.trial_already_used"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back"),
-                        callback_data="user:menu"
-                    )
-                ]])
-            )
-            return
-        
-        # Пользователь сам активирует триал кнопкой
+    if user.get("trial_used"):
         await callback.message.edit_text(
-            _("user.trial_info"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                InlineKeyboardButton(
-                    text=_("user.activate_trial"),
-                    callback_data="user:trial:activate"
-                )
-            ], [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:connect"
-                )
-            ]])
+            _tr(locale, "user.trial_already_used"),
+            reply_markup=_back_to_menu_keyboard(locale)
         )
+        return
+    
+    # Пользователь сам активирует триал кнопкой
+    await callback.message.edit_text(
+        _tr(locale, "user.trial_info"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text=_tr(locale, "user.activate_trial"),
+                callback_data="user:trial:activate"
+            )
+        ], [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:connect"
+            )
+        ]])
+    )
 
 
 @router.callback_query(F.data == "user:trial:activate")
-async def cb_trial_activate(callback: CallbackQuery) -> None:
+async def cb_trial_activate(callback: CallbackQuery, user: dict, locale: str) -> None:
     """Активация пробной подписки (создаёт пользователя в Remnawave)."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        if user.get("trial_used") or user.get("remnawave_user_uuid"):
-            buttons = [
-                [
-                    InlineKeyboardButton(text=_("user_menu.back"), callback_data="user:connect")
-                ]
-            ]
-            await callback.message.edit_text(
-                _("user.trial_already_used"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-            )
-            return
+    if user.get("trial_used") or user.get("remnawave_user_uuid"):
+        await callback.message.edit_text(
+            _tr(locale, "user.trial_already_used"),
+            reply_markup=_back_to_connect_keyboard(locale),
+        )
+        return
 
-        from src.config import get_settings
-        settings = get_settings()
-        trial_days = max(1, int(settings.trial_days))
+    settings = get_settings()
+    trial_days = max(1, int(settings.trial_days))
 
-        # Генерим безопасный username для Remnawave
-        base_username = (callback.from_user.username or "").lstrip("@")
-        if not base_username:
-            base_username = f"tg{user_id}"
+    # Генерим username для Remnawave: Telegram ID делает его уникальным с первой попытки
+    suffix = f"tg{user_id}"
+    base_username = (callback.from_user.username or "").lstrip("@")
+    if base_username:
+        username = f"{base_username[:_REMNAWAVE_USERNAME_MAX - len(suffix) - 1]}_{suffix}"
+    else:
+        username = suffix
 
-        expire_at = (datetime.utcnow() + timedelta(days=trial_days)).replace(microsecond=0).isoformat() + "Z"
+    expire_at = (datetime.utcnow() + timedelta(days=trial_days)).strftime(REMNAWAVE_TS_FORMAT)
 
-        # Подготавливаем сквады
-        internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
-        
-        # Логируем, что передаем
-        logger.info(
-            "Creating trial user for %d: external_squad=%s, internal_squads=%s (type=%s, len=%s)",
-            user_id,
-            settings.default_external_squad_uuid,
-            internal_squads,
-            type(internal_squads).__name__,
-            len(internal_squads) if internal_squads else 0
+    # Подготавливаем сквады
+    internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
+    
+    # Логируем, что передаем
+    logger.info(
+        "Creating trial user for %d: external_squad=%s, internal_squads=%s (type=%s, len=%s)",
+        user_id,
+        settings.default_external_squad_uuid,
+        internal_squads,
+        type(internal_squads).__name__,
+        len(internal_squads) if internal_squads else 0
+    )
+    
+    # Сетевые ошибки повторяет сам api_client
+    created = None
+    try:
+        created = await api_client.create_user(
+            username=username,
+            expire_at=expire_at,
+            telegram_id=user_id,
+            description="trial",
+            external_squad_uuid=settings.default_external_squad_uuid,
+            active_internal_squads=internal_squads,
         )
-        
-        created = None
-        username_try = base_username
-        for attempt in range(3):
-            try:
-                created = await api_client.create_user(
-                    username=username_try,
-                    expire_at=expire_at,
-                    telegram_id=user_id,
-                    description="trial",
-                    external_squad_uuid=settings.default_external_squad_uuid,
-                    active_internal_squads=internal_squads,
-                )
-                logger.info("Trial user created successfully: %s", created.get("response", {}).get("uuid", "unknown"))
-                break
-            except Exception as e:
-                logger.warning(f"Trial activation attempt {attempt+1} failed for user {user_id}: {e}")
-                # возможно конфликт username — добавим суффикс
-                username_try = f"{base_username}_{attempt+1}"
-                continue
-
-        if not created:
-            buttons = [
-                [
-                    InlineKeyboardButton(text=_("user_menu.back"), callback_data="user:connect")
-                ]
-            ]
-            await callback.message.edit_text(
-                _("user.trial_activation_failed"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
-            )
-            return
+        logger.info("Trial user created successfully: %s", created.get("response", {}).get("uuid", "unknown"))
+    except Exception as e:
+        logger.warning("Trial activation failed for user %s (username=%s): %s", user_id, username, e)
 
-        info = created.get("response", created)
-        user_uuid = info.get("uuid")
-        if user_uuid:
-            BotUser.set_remnawave_uuid(user_id, user_uuid)
-        BotUser.set_trial_used(user_id)
-        
-        # Начисляем бонус рефереру (если есть)
-        from src.services.referral_service import grant_referral_bonus
-        from src.services.notification_service import notify_trial_activation, notify_referral_bonus
-        
-        try:
-            referral_data = await grant_referral_bonus(user_id)
-            if referral_data:
-                # Отправляем уведомление о реферальном бонусе
-                await notify_referral_bonus(
-                    callback.bot,
-                    referral_data["referrer_id"],
-                    referral_data["referrer_username"],
-                    referral_data["referred_id"],
-                    referral_data["referred_username"],
-                    referral_data["bonus_days"],
-                    referral_data["new_expire"]
-                )
-        except Exception as ref_exc:
-            logger.warning("Failed to grant referral bonus on trial activation: %s", ref_exc)
-        
-        # Отправляем уведомление об активации триала
-        try:
-            await notify_trial_activation(
+    if not created:
+        await callback.message.edit_text(
+            _tr(locale, "user.trial_activation_failed"),
+            reply_markup=_back_to_connect_keyboard(locale),
+        )
+        return
+
+    info = created.get("response", created)
+    user_uuid = info.get("uuid")
+    if user_uuid:
+        BotUser.set_remnawave_uuid(user_id, user_uuid, info.get("shortUuid"))
+    BotUser.set_trial_used(user_id)
+    
+    # Начисляем бонус рефереру (если есть)
+    try:
+        referral_data = await grant_referral_bonus(user_id)
+        if referral_data:
+            # Отправляем уведомление о реферальном бонусе
+            await notify_referral_bonus(
                 callback.bot,
-                user_id,
-                callback.from_user.username,
-                trial_days,
-                user_uuid
+                referral_data["referrer_id"],
+                referral_data["referrer_username"],
+                referral_data["referred_id"],
+                referral_data["referred_username"],
+                referral_data["bonus_days"],
+                referral_data["new_expire"]
             )
-        except Exception as notif_exc:
-            logger.warning("Failed to send trial activation notification: %s", notif_exc)
-
-        # На всякий случай дожимаем сквады через update (если create проигнорировал)
-        if settings.default_external_squad_uuid or internal_squads:
-            try:
-                update_payload = {}
-                if settings.default_external_squad_uuid:
-                    update_payload["externalSquadUuid"] = settings.default_external_squad_uuid
-                if internal_squads:
-                    update_payload["activeInternalSquads"] = internal_squads
-                
-                if update_payload:
-                    await api_client.update_user(user_uuid, **update_payload)
-                    logger.info(
-                        "Applied squads on trial user %s: external=%s, internal=%s",
-                        user_uuid,
-                        settings.default_external_squad_uuid,
-                        internal_squads
-                    )
-            except Exception as squad_exc:
-                logger.warning("Failed to apply squads on trial user %s: %s", user_uuid, squad_exc)
-
-        # Получаем ссылку на подписку
-        subscription_url = ""
-        short_uuid = info.get("shortUuid")
-        if short_uuid:
-            try:
-                sub_info = await api_client.get_subscription_info(short_uuid)
-                sub_data = sub_info.get("response", sub_info)
-                subscription_url = sub_data.get("subscriptionUrl", "") or ""
-            except Exception:
-                subscription_url = ""
-
-        buttons: list[list[InlineKeyboardButton]] = []
-        if subscription_url:
-            buttons.append([InlineKeyboardButton(text=_("user.get_config"), url=subscription_url)])
-        buttons.append([InlineKeyboardButton(text=_("user_menu.back"), callback_data="user:connect")])
-
-        await callback.message.edit_text(
-            _("user.trial_activated").format(days=trial_days),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+    except Exception as ref_exc:
+        logger.warning("Failed to grant referral bonus on trial activation: %s", ref_exc)
+    
+    # Отправляем уведомление об активации триала
+    try:
+        await notify_trial_activation(
+            callback.bot,
+            user_id,
+            callback.from_user.username,
+            trial_days,
+            user_uuid
         )
+    except Exception as notif_exc:
+        logger.warning("Failed to send trial activation notification: %s", notif_exc)
+
+    # Досылка сквадов (если create их проигнорировал) и получение ссылки на подписку
+    # независимы — выполняем их параллельно
+    update_payload = _missing_squads(info, settings.default_external_squad_uuid, internal_squads)
+    _, subscription_url = await asyncio.gather(
+        _apply_trial_squads(user_uuid, update_payload),
+        _fetch_subscription_url(info.get("shortUuid")),
+    )
+
+    buttons: list[list[InlineKeyboardButton]] = []
+    if subscription_url:
+        buttons.append([InlineKeyboardButton(text=_tr(locale, "user.get_config"), url=subscription_url)])
+    buttons.extend(_back_to_connect_keyboard(locale).inline_keyboard)
+
+    await callback.message.edit_text(
+        _tr(locale, "user.trial_activated").format(days=trial_days),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+    )
 
 
 # Старые обработчики покупки удалены - теперь используется purchase.py
@@ -919,219 +950,149 @@ async def cb_trial_activate(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data == "user:auto_renewal")
-async def cb_auto_renewal(callback: CallbackQuery) -> None:
+async def cb_auto_renewal(callback: CallbackQuery, locale: str) -> None:
     """Обработчик настройки автопродления."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        current_status = BotUser.get_auto_renewal(user_id)
-        
-        if current_status:
-            # Выключаем автопродление
-            BotUser.set_auto_renewal(user_id, False)
-            status_text = _("settings.auto_renewal_disabled")
-        else:
-            # Включаем автопродление
-            BotUser.set_auto_renewal(user_id, True)
-            status_text = _("settings.auto_renewal_enabled")
-        
-        auto_renewal = BotUser.get_auto_renewal(user_id)
-        auto_renewal_text = _("settings.auto_renewal_on") if auto_renewal else _("settings.auto_renewal_off")
-        
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("settings.auto_renewal_info"),
-                    callback_data="user:auto_renewal:info"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=auto_renewal_text,
-                    callback_data="user:auto_renewal"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:settings"
-                )
-            ]
+    current_status = BotUser.get_auto_renewal(user_id)
+    
+    if current_status:
+        # Выключаем автопродление
+        BotUser.set_auto_renewal(user_id, False)
+        status_text = _tr(locale, "settings.auto_renewal_disabled")
+    else:
+        # Включаем автопродление
+        BotUser.set_auto_renewal(user_id, True)
+        status_text = _tr(locale, "settings.auto_renewal_enabled")
+    
+    auto_renewal = BotUser.get_auto_renewal(user_id)
+    auto_renewal_text = _tr(locale, "settings.auto_renewal_on") if auto_renewal else _tr(locale, "settings.auto_renewal_off")
+    
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "settings.auto_renewal_info"),
+                callback_data="user:auto_renewal:info"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=auto_renewal_text,
+                callback_data="user:auto_renewal"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:settings"
+            )
         ]
-        
-        await callback.message.edit_text(
-            status_text + "\n\n" + _("settings.auto_renewal_description"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    ]
+    
+    await callback.message.edit_text(
+        status_text + "\n\n" + _tr(locale, "settings.auto_renewal_description"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
 
 
 @router.callback_query(F.data == "user:auto_renewal:info")
-async def cb_auto_renewal_info(callback: CallbackQuery) -> None:
+async def cb_auto_renewal_info(callback: CallbackQuery, locale: str) -> None:
     """Показывает подробную информацию об автопродлении."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        auto_renewal = BotUser.get_auto_renewal(user_id)
-        auto_renewal_text = _("settings.auto_renewal_on") if auto_renewal else _("settings.auto_renewal_off")
-        
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=auto_renewal_text,
-                    callback_data="user:auto_renewal"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:settings"
-                )
-            ]
+    auto_renewal = BotUser.get_auto_renewal(user_id)
+    auto_renewal_text = _tr(locale, "settings.auto_renewal_on") if auto_renewal else _tr(locale, "settings.auto_renewal_off")
+    
+    buttons = [
+        [
+            InlineKeyboardButton(
+                text=auto_renewal_text,
+                callback_data="user:auto_renewal"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:settings"
+            )
         ]
-        
-        status_text = auto_renewal_text
-        await callback.message.edit_text(
-            _("settings.auto_renewal_full_info").format(status=status_text),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    ]
+    
+    status_text = auto_renewal_text
+    await callback.message.edit_text(
+        _tr(locale, "settings.auto_renewal_full_info").format(status=status_text),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
 
 
 @router.callback_query(F.data == "user:referral")
-async def cb_referral(callback: CallbackQuery) -> None:
+async def cb_referral(callback: CallbackQuery, locale: str) -> None:
     """Показывает реферальную информацию."""
-    await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        referrals_count = Referral.get_referrals_count(user_id)
-        bonus_days = Referral.get_bonus_days(user_id)
-        
-        # Создаем реферальную ссылку
-        try:
-            bot_username = (await callback.message.bot.get_me()).username or "your_bot"
-        except:
-            bot_username = "your_bot"
-        referral_link = f"https://t.me/{bot_username}?start={user_id}"
-        
-        # Узнаём сколько дней даём за реферала
-        from src.config import get_settings
-        settings = get_settings()
-        bonus_per_referral = settings.referral_bonus_days
-        
-        text = _("user.referral_info", locale=locale).format(
-            link=referral_link,
-            count=referrals_count,
-            bonus_days=bonus_days,
-            bonus_per_friend=bonus_per_referral
-        )
-        
-        keyboard = [
-            [
-                InlineKeyboardButton(
-                    text=_("user.copy_referral_link", locale=locale),
-                    url=referral_link
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back", locale=locale),
-                    callback_data="user:settings"
-                )
-            ]
+    referrals_count, bonus_days = Referral.get_stats(user_id)
+    
+    # Создаем реферальную ссылку.
+    # Bot.me() кэширует ответ getMe (его уже запрашивает start_polling при старте),
+    # поэтому лишнего запроса к Telegram на каждое открытие меню нет.
+    try:
+        bot_username = (await callback.bot.me()).username or "your_bot"
+    except TelegramAPIError:
+        bot_username = "your_bot"
+    referral_link = f"https://t.me/{bot_username}?start={user_id}"
+    
+    # Узнаём сколько дней даём за реферала
+    settings = get_settings()
+    bonus_per_referral = settings.referral_bonus_days
+    
+    text = _tr(locale, "user.referral_info").format(
+        link=referral_link,
+        count=referrals_count,
+        bonus_days=bonus_days,
+        bonus_per_friend=bonus_per_referral
+    )
+    
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user.copy_referral_link"),
+                url=referral_link
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=_tr(locale, "user_menu.back"),
+                callback_data="user:settings"
+            )
         ]
-        
-        await callback.message.edit_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
+    ]
+    
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+    )
 
 
 @router.callback_query(F.data == "user:renew")
-async def cb_renew(callback: CallbackQuery) -> None:
+async def cb_renew(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Продлить доступ' - создает invoice для продления."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        # Перенаправляем на покупку подписки
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.buy_subscription"),
-                    callback_data="user:buy"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:menu"
-                )
-            ]
-        ]
-        
-        await callback.message.edit_text(
-            _("renewal.resume_access"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
-            logger.exception("Error creating renewal invoice")
-            await callback.message.edit_text(
-                _("renewal.error_creating_invoice"),
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-                    InlineKeyboardButton(
-                        text=_("user_menu.back"),
-                        callback_data="user:menu"
-                    )
-                ]])
-            )
+    # Перенаправляем на покупку подписки
+    await callback.message.edit_text(
+        _tr(locale, "renewal.resume_access"),
+        reply_markup=_renew_keyboard(locale)
+    )
 
 
 @router.callback_query(F.data == "user:resume")
-async def cb_resume(callback: CallbackQuery) -> None:
+async def cb_resume(callback: CallbackQuery, locale: str) -> None:
     """Обработчик 'Возобновить доступ' после окончания подписки."""
-    await callback.answer()
-    user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
-    locale = user.get("language", "ru")
     
-    i18n = get_i18n()
-    with i18n.use_locale(locale):
-        from src.config import get_settings
-        settings = get_settings()
-        
-        # Перенаправляем на покупку подписки
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.buy_subscription"),
-                    callback_data="user:buy"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=_("user_menu.back"),
-                    callback_data="user:menu"
-                )
-            ]
-        ]
-        
-        await callback.message.edit_text(
-            _("renewal.resume_access"),
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+    # Перенаправляем на покупку подписки
+    await callback.message.edit_text(
+        _tr(locale, "renewal.resume_access"),
+        reply_markup=_renew_keyboard(locale)
+    )
 
 
 # Старые обработчики покупки удалены - теперь используется purchase.py
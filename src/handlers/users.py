@@ -34,6 +34,7 @@ from src.keyboards.user_stats import user_stats_keyboard
 from src.keyboards.hwid_devices import hwid_devices_keyboard
 from src.services.api_client import ApiClientError, NotFoundError, UnauthorizedError, api_client
 from src.utils.formatters import (
+    REMNAWAVE_TS_FORMAT,
     _esc,
     build_created_user,
     build_user_summary,
@@ -65,8 +66,7 @@ def _truncate(text: str, limit: int = 64) -> str:
 
 def _iso_from_days(days: int) -> str:
     """Преобразует количество дней в ISO строку даты."""
-    now = datetime.utcnow()
-    return (now + timedelta(days=days)).replace(microsecond=0).isoformat() + "Z"
+    return (datetime.utcnow() + timedelta(days=days)).strftime(REMNAWAVE_TS_FORMAT)
 
 
 def _user_matches_query(user: dict, normalized_query: str) -> bool:
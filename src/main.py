@@ -55,11 +55,11 @@ async def check_api_connection() -> bool:
 
 async def main() -> None:
     import os
-    # Логируем сырое значение переменной окружения для отладки
-    raw_admins_env = os.getenv("ADMINS", "NOT_SET")
-    logger.info("🔍 DEBUG: Raw ADMINS env var: %s", repr(raw_admins_env))
-    
     settings = get_settings()
+    settings.log_config_sources()
+    
+    # Логируем сырое значение переменной окружения для отладки
+    logger.debug("🔍 Raw ADMINS env var: %r", os.getenv("ADMINS", "NOT_SET"))
     
     # Логируем загруженных администраторов для отладки
     logger.info(
@@ -74,12 +74,10 @@ async def main() -> None:
         )
     
     # Логируем настройки уведомлений
-    raw_chat_id = os.getenv("NOTIFICATIONS_CHAT_ID", "NOT_SET")
-    raw_topic_id = os.getenv("NOTIFICATIONS_TOPIC_ID", "NOT_SET")
     logger.info(
-        "📢 Notifications config: raw_chat_id=%s raw_topic_id=%s parsed_chat_id=%s parsed_topic_id=%s",
-        repr(raw_chat_id),
-        repr(raw_topic_id),
+        "📢 Notifications config: raw_chat_id=%r raw_topic_id=%r parsed_chat_id=%s parsed_topic_id=%s",
+        os.getenv("NOTIFICATIONS_CHAT_ID", "NOT_SET"),
+        os.getenv("NOTIFICATIONS_TOPIC_ID", "NOT_SET"),
         settings.notifications_chat_id,
         settings.notifications_topic_id,
     )
@@ -39,7 +39,10 @@ class RemnawaveApiClient:
             base_url=base_url,
             headers=self._build_headers(),
             timeout=timeout_config,
-            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+            # Один клиент на процесс: соединения переиспользуются между запросами.
+            # keepalive_expiry по умолчанию 5 с — между кликами пользователей соединение
+            # успевало закрыться, и каждый запрос снова платил за TCP/TLS handshake.
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20, keepalive_expiry=60.0),
             follow_redirects=True,  # Автоматически следовать редиректам (HTTP -> HTTPS)
         )
 
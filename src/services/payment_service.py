@@ -1,13 +1,33 @@
 """Сервис для работы с платежами через Telegram Stars и YooKassa."""
+import asyncio
 from datetime import datetime, timedelta
+from types import MappingProxyType
 
 from aiogram import Bot
 from aiogram.types import LabeledPrice
 
 from src.config import get_settings
-from src.database import Payment
+from src.database import BotUser, Payment, PromoCode
+from src.services.api_client import api_client
+from src.services.notification_service import notify_payment_success, notify_referral_bonus
+from src.services.referral_service import grant_referral_bonus
+from src.services.yookassa_service import create_payment
+from src.utils.formatters import REMNAWAVE_TS_FORMAT, parse_remnawave_ts
 from src.utils.logger import logger
 
+# Срок подписки для описания платежа: месяцы -> (ru, en)
+_PERIOD_LABELS = MappingProxyType({
+    1: ("1 месяц", "1 month"),
+    3: ("3 месяца", "3 months"),
+    6: ("6 месяцев", "6 months"),
+    12: ("12 месяцев", "12 months"),
+})
+
+# Платежи YooKassa, обработка которых идет прямо сейчас. Повторная проверка статуса
+# того же платежа (например, двойное нажатие кнопки) дожидается уже запущенной
+# обработки, а не продлевает подписку второй раз.
+_yookassa_in_flight: dict[str, asyncio.Task] = {}
+
 
 async def create_subscription_invoice(
     bot: Bot,
@@ -26,30 +46,20 @@ async def create_subscription_invoice(
     Returns:
         Ссылка на оплату
     """
-    settings = get_settings()
-    
-    # Получаем цену в Stars
-    stars_prices = {
-        1: settings.subscription_stars_1month,
-        3: settings.subscription_stars_3months,
-        6: settings.subscription_stars_6months,
-        12: settings.subscription_stars_12months,
-    }
-    
-    if subscription_months not in stars_prices:
+    if subscription_months not in _PERIOD_LABELS:
         raise ValueError(f"Invalid subscription months: {subscription_months}")
     
-    base_stars = stars_prices[subscription_months]
+    # Получаем цену в Stars
+    base_stars = get_settings().stars_prices[subscription_months]
     
     # Применяем промокод (если есть)
     discount_percent = 0
     if promo_code:
-        from src.database import PromoCode
-        promo = PromoCode.get(promo_code)
+        promo = PromoCode.get_cached(promo_code)
         if promo:
             discount_percent = promo.get("discount_percent", 0) or 0
     
-    stars = int(base_stars * (1 - discount_percent / 100))
+    stars = base_stars * (100 - discount_percent) // 100
     # Telegram не принимает нулевую сумму
     stars = max(1, stars)
     subscription_days = subscription_months * 30
@@ -67,14 +77,7 @@ async def create_subscription_invoice(
     )
     
     # Описание подписки
-    locale_map = {
-        1: ("1 месяц", "1 month"),
-        3: ("3 месяца", "3 months"),
-        6: ("6 месяцев", "6 months"),
-        12: ("12 месяцев", "12 months"),
-    }
-    
-    description_ru, description_en = locale_map[subscription_months]
+    description_ru, description_en = _PERIOD_LABELS[subscription_months]
     description = f"Подписка Remnawave {description_ru} | Remnawave subscription {description_en}"
     price_label = f"Remnawave {subscription_months}m"
     
@@ -124,44 +127,25 @@ async def create_yookassa_payment(
     Returns:
         Словарь с данными платежа (payment_id, qr_code, confirmation_url, amount)
     """
-    from src.services.yookassa_service import create_payment
-    
-    settings = get_settings()
-    
-    # Получаем цену в рублях
-    rub_prices = {
-        1: settings.subscription_rub_1month,
-        3: settings.subscription_rub_3months,
-        6: settings.subscription_rub_6months,
-        12: settings.subscription_rub_12months,
-    }
-    
-    if subscription_months not in rub_prices:
+    if subscription_months not in _PERIOD_LABELS:
         raise ValueError(f"Invalid subscription months: {subscription_months}")
     
-    base_amount = rub_prices[subscription_months]
+    # Получаем цену в рублях
+    base_amount = get_settings().rub_prices[subscription_months]
     
     # Применяем промокод (если есть)
     discount_percent = 0
     if promo_code:
-        from src.database import PromoCode
-        promo = PromoCode.get(promo_code)
+        promo = PromoCode.get_cached(promo_code)
         if promo:
             discount_percent = promo.get("discount_percent", 0) or 0
     
-    amount = base_amount * (1 - discount_percent / 100)
+    amount = base_amount * (100 - discount_percent) / 100
     amount = max(1.0, amount)  # Минимум 1 рубль
     subscription_days = subscription_months * 30
     
     # Описание подписки
-    locale_map = {
-        1: ("1 месяц", "1 month"),
-        3: ("3 месяца", "3 months"),
-        6: ("6 месяцев", "6 months"),
-        12: ("12 месяцев", "12 months"),
-    }
-    
-    description_ru, description_en = locale_map[subscription_months]
+    description_ru, description_en = _PERIOD_LABELS[subscription_months]
     description = f"Подписка Remnawave {description_ru} | Remnawave subscription {description_en}"
     
     # Создаем платеж в YooKassa
@@ -219,6 +203,7 @@ async def process_successful_payment(
     Returns:
         Словарь с результатом (success, user_uuid, subscription_url, error)
     """
+    payment = None
     try:
         # Парсим короткий payload формата: user_id:months:stars:promo
         parts = invoice_payload.split(":")
@@ -259,15 +244,13 @@ async def process_successful_payment(
             return {"success": False, "error": "Amount mismatch"}
         
         # Получаем информацию о пользователе
-        from src.database import BotUser
         bot_user = BotUser.get_or_create(user_id, None)
         username = bot_user.get("username") or f"user_{user_id}"
         
         # Вычисляем дату истечения
-        expire_date = (datetime.now() + timedelta(days=subscription_days)).replace(microsecond=0).isoformat() + "Z"
+        expire_date = (datetime.now() + timedelta(days=subscription_days)).strftime(REMNAWAVE_TS_FORMAT)
         
         # Создаем пользователя в Remnawave
-        from src.services.api_client import api_client
         settings = get_settings()
         
         remnawave_uuid = bot_user.get("remnawave_user_uuid")
@@ -276,7 +259,9 @@ async def process_successful_payment(
             # Обновляем существующего пользователя
             try:
                 user_data = await api_client.get_user_by_uuid(remnawave_uuid)
-                current_expire = user_data.get("response", {}).get("expireAt")
+                user_info = user_data.get("response", user_data)
+                current_expire = user_info.get("expireAt")
+                short_uuid = user_info.get("shortUuid")
                 
                 try:
                     desired_external = settings.default_external_squad_uuid
@@ -291,9 +276,9 @@ async def process_successful_payment(
                     logger.warning("Failed to apply squads to existing user %s: %s", remnawave_uuid, squad_exc)
                 
                 if current_expire:
-                    current_dt = datetime.fromisoformat(current_expire.replace("Z", "+00:00"))
+                    current_dt = parse_remnawave_ts(current_expire)
                     if current_dt > datetime.now(current_dt.tzinfo):
-                        expire_date = (current_dt + timedelta(days=subscription_days)).replace(microsecond=0).isoformat() + "Z"
+                        expire_date = (current_dt + timedelta(days=subscription_days)).strftime(REMNAWAVE_TS_FORMAT)
                 
                 await api_client.update_user(remnawave_uuid, expireAt=expire_date)
                 user_uuid = remnawave_uuid
@@ -310,7 +295,8 @@ async def process_successful_payment(
                 )
                 user_info = user_data.get("response", user_data)
                 user_uuid = user_info.get("uuid")
-                BotUser.set_remnawave_uuid(user_id, user_uuid)
+                short_uuid = user_info.get("shortUuid")
+                BotUser.set_remnawave_uuid(user_id, user_uuid, short_uuid)
         else:
             # Создаем нового пользователя
             internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
@@ -324,7 +310,8 @@ async def process_successful_payment(
             )
             user_info = user_data.get("response", user_data)
             user_uuid = user_info.get("uuid")
-            BotUser.set_remnawave_uuid(user_id, user_uuid)
+            short_uuid = user_info.get("shortUuid")
+            BotUser.set_remnawave_uuid(user_id, user_uuid, short_uuid)
             
             if settings.default_external_squad_uuid or internal_squads:
                 try:
@@ -339,10 +326,11 @@ async def process_successful_payment(
                 except Exception as squad_exc:
                     logger.warning("Failed to apply squads on payment user %s: %s", user_uuid, squad_exc)
         
-        # Получаем ссылку на подписку
-        user_full = await api_client.get_user_by_uuid(user_uuid)
-        user_full_info = user_full.get("response", user_full)
-        short_uuid = user_full_info.get("shortUuid")
+        # Получаем ссылку на подписку. shortUuid уже есть в ответе get_user_by_uuid /
+        # create_user; повторно запрашиваем пользователя, только если его там не было
+        if not short_uuid:
+            user_full = await api_client.get_user_by_uuid(user_uuid)
+            short_uuid = user_full.get("response", user_full).get("shortUuid")
         
         subscription_url = ""
         if short_uuid:
@@ -358,16 +346,12 @@ async def process_successful_payment(
         
         # Применяем промокод (если есть)
         if promo_code:
-            from src.database import PromoCode
             PromoCode.use(promo_code, user_id)
         
         # Начисляем бонус рефереру (если есть)
-        from src.services.referral_service import grant_referral_bonus
-        
         try:
             referral_data = await grant_referral_bonus(user_id)
             if referral_data and bot:
-                from src.services.notification_service import notify_referral_bonus
                 await notify_referral_bonus(
                     bot,
                     referral_data["referrer_id"],
@@ -382,7 +366,6 @@ async def process_successful_payment(
         
         # Отправляем уведомление об успешной оплате
         if bot:
-            from src.services.notification_service import notify_payment_success
             try:
                 await notify_payment_success(
                     bot,
@@ -407,7 +390,7 @@ async def process_successful_payment(
         }
     except Exception as e:
         logger.exception(f"Failed to process payment for user {user_id}: {e}")
-        payment = Payment.get_by_payload(invoice_payload)
+        # Строка платежа уже загружена выше (если до этого дошло) — повторно не читаем
         if payment:
             Payment.update_status(payment["id"], "failed")
         return {"success": False, "error": str(e)}
@@ -419,6 +402,9 @@ async def process_yookassa_payment(
 ) -> dict:
     """Обрабатывает успешный платеж через YooKassa и создает пользователя в Remnawave.
     
+    Одновременные вызовы для одного платежа выполняют обработку один раз
+    и получают общий результат.
+    
     Args:
         yookassa_payment_id: ID платежа в YooKassa
         bot: Экземпляр бота (опционально)
@@ -426,6 +412,18 @@ async def process_yookassa_payment(
     Returns:
         Словарь с результатом (success, user_uuid, subscription_url, error)
     """
+    task = _yookassa_in_flight.get(yookassa_payment_id)
+    if task is None:
+        task = asyncio.create_task(_process_yookassa_payment(yookassa_payment_id, bot))
+        _yookassa_in_flight[yookassa_payment_id] = task
+        task.add_done_callback(lambda _: _yookassa_in_flight.pop(yookassa_payment_id, None))
+    # shield: отмена одного из ожидающих обработчиков не должна прерывать сам платеж
+    return await asyncio.shield(task)
+
+
+async def _process_yookassa_payment(yookassa_payment_id: str, bot: Bot | None) -> dict:
+    """Обработка платежа YooKassa; вызывается только через process_yookassa_payment."""
+    payment = None
     try:
         # Находим платеж в БД
         payment = Payment.get_by_yookassa_payment_id(yookassa_payment_id)
@@ -455,15 +453,13 @@ async def process_yookassa_payment(
             subscription_months = subscription_days // 30
         
         # Получаем информацию о пользователе
-        from src.database import BotUser
         bot_user = BotUser.get_or_create(user_id, None)
         username = bot_user.get("username") or f"user_{user_id}"
         
         # Вычисляем дату истечения
-        expire_date = (datetime.now() + timedelta(days=subscription_days)).replace(microsecond=0).isoformat() + "Z"
+        expire_date = (datetime.now() + timedelta(days=subscription_days)).strftime(REMNAWAVE_TS_FORMAT)
         
         # Создаем пользователя в Remnawave
-        from src.services.api_client import api_client
         settings = get_settings()
         
         remnawave_uuid = bot_user.get("remnawave_user_uuid")
@@ -472,7 +468,9 @@ async def process_yookassa_payment(
             # Обновляем существующего пользователя
             try:
                 user_data = await api_client.get_user_by_uuid(remnawave_uuid)
-                current_expire = user_data.get("response", {}).get("expireAt")
+                user_info = user_data.get("response", user_data)
+                current_expire = user_info.get("expireAt")
+                short_uuid = user_info.get("shortUuid")
                 
                 try:
                     desired_external = settings.default_external_squad_uuid
@@ -487,9 +485,9 @@ async def process_yookassa_payment(
                     logger.warning("Failed to apply squads to existing user %s: %s", remnawave_uuid, squad_exc)
                 
                 if current_expire:
-                    current_dt = datetime.fromisoformat(current_expire.replace("Z", "+00:00"))
+                    current_dt = parse_remnawave_ts(current_expire)
                     if current_dt > datetime.now(current_dt.tzinfo):
-                        expire_date = (current_dt + timedelta(days=subscription_days)).replace(microsecond=0).isoformat() + "Z"
+                        expire_date = (current_dt + timedelta(days=subscription_days)).strftime(REMNAWAVE_TS_FORMAT)
                 
                 await api_client.update_user(remnawave_uuid, expireAt=expire_date)
                 user_uuid = remnawave_uuid
@@ -507,7 +505,8 @@ async def process_yookassa_payment(
                 )
                 user_info = user_data.get("response", user_data)
                 user_uuid = user_info.get("uuid")
-                BotUser.set_remnawave_uuid(user_id, user_uuid)
+                short_uuid = user_info.get("shortUuid")
+                BotUser.set_remnawave_uuid(user_id, user_uuid, short_uuid)
         else:
             # Создаем нового пользователя
             internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
@@ -521,7 +520,8 @@ async def process_yookassa_payment(
             )
             user_info = user_data.get("response", user_data)
             user_uuid = user_info.get("uuid")
-            BotUser.set_remnawave_uuid(user_id, user_uuid)
+            short_uuid = user_info.get("shortUuid")
+            BotUser.set_remnawave_uuid(user_id, user_uuid, short_uuid)
             
             if settings.default_external_squad_uuid or internal_squads:
                 try:
@@ -536,10 +536,11 @@ async def process_yookassa_payment(
                 except Exception as squad_exc:
                     logger.warning("Failed to apply squads on payment user %s: %s", user_uuid, squad_exc)
         
-        # Получаем ссылку на подписку
-        user_full = await api_client.get_user_by_uuid(user_uuid)
-        user_full_info = user_full.get("response", user_full)
-        short_uuid = user_full_info.get("shortUuid")
+        # Получаем ссылку на подписку. shortUuid уже есть в ответе get_user_by_uuid /
+        # create_user; повторно запрашиваем пользователя, только если его там не было
+        if not short_uuid:
+            user_full = await api_client.get_user_by_uuid(user_uuid)
+            short_uuid = user_full.get("response", user_full).get("shortUuid")
         
         subscription_url = ""
         if short_uuid:
@@ -555,16 +556,12 @@ async def process_yookassa_payment(
         
         # Применяем промокод (если есть)
         if promo_code:
-            from src.database import PromoCode
             PromoCode.use(promo_code, user_id)
         
         # Начисляем бонус рефереру (если есть)
-        from src.services.referral_service import grant_referral_bonus
-        
         try:
             referral_data = await grant_referral_bonus(user_id)
             if referral_data and bot:
-                from src.services.notification_service import notify_referral_bonus
                 await notify_referral_bonus(
                     bot,
                     referral_data["referrer_id"],
@@ -579,7 +576,6 @@ async def process_yookassa_payment(
         
         # Отправляем уведомление об успешной оплате
         if bot:
-            from src.services.notification_service import notify_payment_success
             try:
                 await notify_payment_success(
                     bot,
@@ -604,7 +600,6 @@ async def process_yookassa_payment(
         }
     except Exception as e:
         logger.exception(f"Failed to process YooKassa payment {yookassa_payment_id}: {e}")
-        payment = Payment.get_by_yookassa_payment_id(yookassa_payment_id)
         if payment:
             Payment.update_status(payment["id"], "failed")
         return {"success": False, "error": str(e)}
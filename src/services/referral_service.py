@@ -1,9 +1,10 @@
 """Сервис реферальной программы."""
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from src.config import get_settings
 from src.database import BotUser, Referral
 from src.services.api_client import api_client
+from src.utils.formatters import REMNAWAVE_TS_FORMAT, parse_remnawave_ts
 from src.utils.logger import logger
 
 
@@ -72,9 +73,9 @@ async def grant_referral_bonus(referred_user_id: int) -> dict | None:
             return None
         
         # Продлеваем подписку на bonus_days
-        current_dt = datetime.fromisoformat(current_expire.replace("Z", "+00:00"))
+        current_dt = parse_remnawave_ts(current_expire)
         new_expire = current_dt + timedelta(days=bonus_days)
-        new_expire_iso = new_expire.replace(microsecond=0).isoformat() + "Z"
+        new_expire_iso = new_expire.strftime(REMNAWAVE_TS_FORMAT)
         
         # Обновляем expireAt в Remnawave
         await api_client.update_user(referrer_uuid, expireAt=new_expire_iso)
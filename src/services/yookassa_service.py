@@ -1,5 +1,7 @@
 """Сервис для работы с платежами через YooKassa."""
+import asyncio
 import io
+from functools import lru_cache
 from typing import Optional
 
 import qrcode
@@ -9,18 +11,37 @@ from src.config import get_settings
 from src.utils.logger import logger
 
 
-def init_yookassa():
-    """Инициализирует YooKassa с настройками из конфига."""
-    settings = get_settings()
-    if not settings.yookassa_shop_id or not settings.yookassa_secret_key:
+@lru_cache(maxsize=1)
+def _configure(shop_id: str | None, secret_key: str | None) -> bool:
+    """Прописывает учетные данные в SDK; повторно выполняется только при их смене."""
+    if not shop_id or not secret_key:
         logger.warning("YooKassa credentials not configured")
         return False
     
-    Configuration.account_id = settings.yookassa_shop_id
-    Configuration.secret_key = settings.yookassa_secret_key
+    Configuration.account_id = shop_id
+    Configuration.secret_key = secret_key
     return True
 
 
+@lru_cache(maxsize=512)
+def _render_qr_png(url: str) -> bytes:
+    """Рендерит QR-код для URL в PNG (результат кэшируется по URL)."""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(url)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
+
+def init_yookassa():
+    """Инициализирует YooKassa с настройками из конфига."""
+    settings = get_settings()
+    return _configure(settings.yookassa_shop_id, settings.yookassa_secret_key)
+
+
 async def create_payment(
     amount: float,
     description: str,
@@ -45,8 +66,6 @@ async def create_payment(
     if not init_yookassa():
         raise ValueError("YooKassa not configured")
     
-    settings = get_settings()
-    
     # Формируем метаданные
     payment_metadata = {
         "user_id": str(user_id),
@@ -84,7 +103,8 @@ async def create_payment(
     }
     
     try:
-        payment = Payment.create(payment_data)
+        # SDK YooKassa синхронный (requests) — выполняем запрос вне event loop
+        payment = await asyncio.to_thread(Payment.create, payment_data)
         payment_id = payment.id
         confirmation = payment.confirmation
         
@@ -102,16 +122,8 @@ async def create_payment(
         qr_code_data = None
         if confirmation_url:
             try:
-                qr = qrcode.QRCode(version=1, box_size=10, border=5)
-                qr.add_data(confirmation_url)
-                qr.make(fit=True)
-                
-                # Создаем изображение QR-кода
-                img = qr.make_image(fill_color="black", back_color="white")
-                img_buffer = io.BytesIO()
-                img.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                qr_code_data = img_buffer.getvalue()
+                # Рендеринг PNG нагружает CPU — выполняем вне event loop
+                qr_code_data = await asyncio.to_thread(_render_qr_png, confirmation_url)
             except Exception as e:
                 logger.warning(f"Failed to generate QR code: {e}")
         
@@ -143,7 +155,7 @@ async def get_payment_status(payment_id: str) -> dict:
         raise ValueError("YooKassa not configured")
     
     try:
-        payment = Payment.find_one(payment_id)
+        payment = await asyncio.to_thread(Payment.find_one, payment_id)
         return {
             "id": payment.id,
             "status": payment.status,
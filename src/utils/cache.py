@@ -0,0 +1,48 @@
+"""Простой in-memory кэш с ограничением размера и временем жизни записей."""
+import time
+from collections import OrderedDict
+from collections.abc import Hashable, Iterator, MutableMapping
+from typing import Any
+
+
+class TTLCache(MutableMapping):
+    """Словарь, записи которого устаревают через ``ttl`` секунд.
+
+    При превышении ``maxsize`` вытесняется самая старая запись.
+    Кэш рассчитан на использование из одного event loop и не потокобезопасен.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __getitem__(self, key: Hashable) -> Any:
+        expires_at, value = self._data[key]
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key: Hashable) -> None:
+        del self._data[key]
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[Hashable]:
+        now = time.monotonic()
+        return iter([key for key, (expires_at, _) in self._data.items() if expires_at > now])
+
+    def __len__(self) -> int:
+        return len(self._data)
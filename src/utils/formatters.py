@@ -1,9 +1,13 @@
-﻿from datetime import datetime
+﻿from datetime import datetime, timezone
 from typing import Any, Callable
 import html
 
 
 NA = "n/a"
+# Формат дат, который принимает Remnawave (UTC, без микросекунд)
+REMNAWAVE_TS_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
 def _esc(value: Any) -> str:
     return html.escape("" if value is None else str(value))
 
@@ -33,6 +37,21 @@ def format_bytes(value: float | int | None) -> str:
     return f"{size:.1f} PB"
 
 
+def parse_remnawave_ts(value: str) -> datetime:
+    """Разбирает метку времени Remnawave (YYYY-MM-DDTHH:MM:SS[.fff]Z, UTC).
+    
+    Формат у Remnawave фиксированный, поэтому поля берутся срезами;
+    другие варианты записи разбираются через datetime.fromisoformat.
+    """
+    if len(value) >= 20 and value[-1] == "Z" and value[19] in ".Z":
+        return datetime(
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19]),
+            tzinfo=timezone.utc,
+        )
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
 def format_datetime(dt_str: str | None) -> str:
     if not dt_str:
         return NA
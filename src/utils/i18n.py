@@ -59,9 +59,16 @@ class JsonI18n(I18n):
         return translations
 
 
+_i18n_cache: I18n | None = None
+
+
 def get_i18n() -> I18n:
-    settings = get_settings()
-    return JsonI18n(path=BASE_LOCALES_PATH, default_locale=settings.default_locale, domain="messages")
+    """Возвращает общий экземпляр I18n (каталоги читаются с диска один раз)."""
+    global _i18n_cache
+    if _i18n_cache is None:
+        settings = get_settings()
+        _i18n_cache = JsonI18n(path=BASE_LOCALES_PATH, default_locale=settings.default_locale, domain="messages")
+    return _i18n_cache
 
 
 def get_i18n_middleware() -> I18nMiddleware:
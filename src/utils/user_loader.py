@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from src.database import BotUser
+from src.utils.i18n import get_i18n
+
+
+class UserLoaderMiddleware(BaseMiddleware):
+    """Middleware, загружающий пользователя бота один раз на апдейт.
+
+    Кладёт запись пользователя в ``data["user"]`` и его язык в ``data["locale"]``,
+    чтобы обработчики не делали ``BotUser.get_or_create`` самостоятельно.
+    Обработчик выполняется внутри ``use_locale`` с языком пользователя,
+    так что ``_(...)`` в нём сразу возвращает нужный перевод.
+
+    На CallbackQuery отвечает сам (без текста), параллельно с загрузкой
+    пользователя и работой обработчика, поэтому обработчики не вызывают
+    ``callback.answer()`` в начале.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        ack = asyncio.create_task(event.answer()) if isinstance(event, CallbackQuery) else None
+        try:
+            from_user = getattr(event, "from_user", None)
+            if from_user is not None:
+                user = await asyncio.to_thread(BotUser.get_or_create, from_user.id, from_user.username)
+                data["user"] = user
+                data["locale"] = locale = user.get("language", "ru")
+                with get_i18n().use_locale(locale):
+                    return await handler(event, data)
+            return await handler(event, data)
+        finally:
+            if ack is not None:
+                await ack
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from src.handlers import user_public  # noqa: E402
+
+
+def test_get_subscription_info_caches_api_response(monkeypatch):
+    calls = []
+
+    async def fake_get_subscription_info(short_uuid):
+        calls.append(short_uuid)
+        return {"response": {"subscriptionUrl": f"https://sub.example/{short_uuid}"}}
+
+    user_public._subscription_info_cache.clear()
+    monkeypatch.setattr(user_public.api_client, "get_subscription_info", fake_get_subscription_info)
+
+    first = asyncio.run(user_public._get_subscription_info("abc"))
+    second = asyncio.run(user_public._get_subscription_info("abc"))
+
+    assert calls == ["abc"]
+    assert first == second == {"response": {"subscriptionUrl": "https://sub.example/abc"}}
+    user_public._subscription_info_cache.clear()